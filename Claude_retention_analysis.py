@@ -8,9 +8,12 @@ et par segments (fréquence, source, médium, PSP, revenus)
 Version finale avec analyse jusqu'à M25
 """
 
+import os
 import pandas as pd
 import numpy as np
+import xlsxwriter
 from datetime import datetime, timedelta
+from export_excel import write_excel_sheet
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -18,62 +21,37 @@ def load_and_clean_data(file_path):
     """Charge et nettoie les données de transaction"""
     print("=== CHARGEMENT ET NETTOYAGE DES DONNÉES ===")
     
-    # Charger les données
-    df = pd.read_csv(file_path, encoding='utf-8')
+    # Charger les données (lecteur pyarrow, multi-thread ; composantes de date en petits entiers nullables)
+    date_dtypes = {
+        'order_date (Année)': 'Int16', 'order_date (Mois)': 'Int8', 'order_date (Jour du mois)': 'Int8',
+        'ECHEANCE_annee': 'Int16', 'ECHEANCE_mois': 'Int8', 'ECHEANCE_jour': 'Int8'
+    }
+    df = pd.read_csv(file_path, encoding='utf-8', engine='pyarrow', dtype=date_dtypes)
     print(f"✓ {len(df):,} transactions chargées")
     print(f"✓ {df['customer_id'].nunique():,} clients uniques")
     
-    # Utiliser les noms exacts des colonnes de votre fichier
-    try:
-        # Convertir les dates avec les noms exacts
-        df['order_date'] = pd.to_datetime(df[['order_date (Année)', 'order_date (Mois)', 'order_date (Jour du mois)']])
-        df['echeance_date'] = pd.to_datetime(df[['ECHEANCE_annee', 'ECHEANCE_mois', 'ECHEANCE_jour']])
-        print("✓ Conversion des dates réussie")
-    except Exception as e:
-        print(f"ERREUR lors de la conversion des dates: {e}")
-        # Méthode alternative avec concaténation
-        try:
-            df['order_date'] = pd.to_datetime(
-                df['order_date (Année)'].astype(str) + '-' + 
-                df['order_date (Mois)'].astype(str) + '-' + 
-                df['order_date (Jour du mois)'].astype(str)
-            )
-            df['echeance_date'] = pd.to_datetime(
-                df['ECHEANCE_annee'].astype(str) + '-' + 
-                df['ECHEANCE_mois'].astype(str) + '-' + 
-                df['ECHEANCE_jour'].astype(str)
-            )
-            print("✓ Conversion alternative réussie")
-        except Exception as e2:
-            print(f"ERREUR finale: {e2}")
-            # Dernière tentative avec gestion des valeurs manquantes
-            try:
-                # Nettoyer les données avant conversion
-                df_clean = df.dropna(subset=['order_date (Année)', 'order_date (Mois)', 'order_date (Jour du mois)',
-                                           'ECHEANCE_annee', 'ECHEANCE_mois', 'ECHEANCE_jour'])
-                
-                df_clean['order_date'] = pd.to_datetime(
-                    df_clean['order_date (Année)'].astype(int).astype(str) + '-' + 
-                    df_clean['order_date (Mois)'].astype(int).astype(str) + '-' + 
-                    df_clean['order_date (Jour du mois)'].astype(int).astype(str)
-                )
-                df_clean['echeance_date'] = pd.to_datetime(
-                    df_clean['ECHEANCE_annee'].astype(int).astype(str) + '-' + 
-                    df_clean['ECHEANCE_mois'].astype(int).astype(str) + '-' + 
-                    df_clean['ECHEANCE_jour'].astype(int).astype(str)
-                )
-                
-                # Remplacer le dataframe original
-                df = df_clean
-                print("✓ Conversion avec nettoyage réussie")
-            except Exception as e3:
-                print(f"ERREUR finale après nettoyage: {e3}")
-                return None
+    # Convertir les dates en une seule passe à partir des colonnes année / mois / jour
+    # (NaT si une composante est manquante ou invalide, ces lignes sont écartées ci-dessous)
+    date_columns = {
+        'order_date': ['order_date (Année)', 'order_date (Mois)', 'order_date (Jour du mois)'],
+        'echeance_date': ['ECHEANCE_annee', 'ECHEANCE_mois', 'ECHEANCE_jour']
+    }
+    # (passage en float32 : l'assemblage ne gère pas les NA des entiers nullables)
+    for date_col, parts in date_columns.items():
+        df[date_col] = pd.to_datetime(df[parts].astype('float32').set_axis(['year', 'month', 'day'], axis=1), errors='coerce')
+    print("✓ Conversion des dates réussie")
     
     # Nettoyer les données
     df = df.dropna(subset=['order_date', 'echeance_date', 'customer_id'])
     df = df.sort_values(['customer_id', 'order_date'])
     
+    # Stocker les colonnes de segmentation (faible cardinalité) en catégories
+    # et réduire les colonnes entières au plus petit type suffisant
+    for col in ['frequence', 'type', 'payment_origin', 'psp', 'tm_source', 'tm_medium', 'tm_campaign']:
+        df[col] = df[col].astype('category')
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    
     print(f"✓ Données nettoyées: {len(df):,} transactions valides")
     print(f"✓ Période: {df['order_date'].min().strftime('%m/%Y')} à {df['order_date'].max().strftime('%m/%Y')}")
     
@@ -83,61 +61,49 @@ def create_monthly_retention_table(df):
     """Crée une table avec une ligne par mois d'activité pour chaque abonnement"""
     print("\n=== CRÉATION DE LA TABLE MENSUELLE ===")
     
-    monthly_data = []
-    total_customers = df['customer_id'].nunique()
-    
-    # Traiter chaque client
-    for idx, customer_id in enumerate(df['customer_id'].unique()):
-        if idx % 1000 == 0:
-            print(f"  Traitement: {idx + 1:,}/{total_customers:,} clients")
-            
-        customer_data = df[df['customer_id'] == customer_id].copy()
-        
-        # Date de début du parcours client
-        journey_start = customer_data['order_date'].min()
-        journey_start_month = journey_start.replace(day=1)
-        
-        # Traiter chaque transaction
-        for _, transaction in customer_data.iterrows():
-            # Générer tous les mois couverts par cette transaction
-            start_month = transaction['order_date'].replace(day=1)
-            end_month = transaction['echeance_date'].replace(day=1)
-            
-            current_month = start_month
-            while current_month <= end_month:
-                # Calculer le mois relatif
-                months_diff = (current_month.year - journey_start_month.year) * 12 + \
-                             (current_month.month - journey_start_month.month)
-                
-                monthly_data.append({
-                    'customer_id': customer_id,
-                    'subscription_id': transaction['subscription_id'],
-                    'mois': current_month.strftime('%m/%Y'),
-                    'mois_relatif': months_diff,
-                    'date_debut_parcours': journey_start_month.strftime('%m/%Y'),
-                    'frequence': transaction['frequence'],
-                    'type': transaction['type'],
-                    'payment_origin': transaction['payment_origin'],
-                    'psp': transaction['psp'],
-                    'tm_source': transaction['tm_source'],
-                    'tm_medium': transaction['tm_medium'],
-                    'tm_campaign': transaction['tm_campaign'],
-                    'consolidated_revenues_ht_euro': transaction['consolidated_revenues_ht_euro']
-                })
-                
-                # Passer au mois suivant
-                if current_month.month == 12:
-                    current_month = current_month.replace(year=current_month.year + 1, month=1)
-                else:
-                    current_month = current_month.replace(month=current_month.month + 1)
-    
-    monthly_df = pd.DataFrame(monthly_data)
-    
-    # Dédupliquer (un client ne peut être actif qu'une fois par mois)
-    monthly_df = monthly_df.drop_duplicates(subset=['customer_id', 'mois'])
+    # Bornes mensuelles de chaque transaction et du parcours client (datetime64[M])
+    start_months = df['order_date'].values.astype('datetime64[M]')
+    end_months = df['echeance_date'].values.astype('datetime64[M]')
+    journey_start_months = df.groupby('customer_id')['order_date'].transform('min').values.astype('datetime64[M]')
+
+    # Nombre de mois couverts par chaque transaction (aucun si l'échéance précède la commande)
+    n_months = np.maximum((end_months - start_months).astype(np.int64) + 1, 0)
+
+    # Générer tous les couples (transaction, mois) en une seule opération vectorisée
+    row_idx = np.repeat(np.arange(len(df)), n_months)
+    offsets = np.arange(n_months.sum()) - np.repeat(n_months.cumsum() - n_months, n_months)
+    month_values = start_months[row_idx] + offsets.astype('timedelta64[M]')
+
+    # Dédupliquer avant de construire la table (un client ne peut être actif qu'une fois par mois) :
+    # on garde la première occurrence de chaque couple (client, mois), dans l'ordre d'origine
+    customer_codes = pd.factorize(df['customer_id'])[0][row_idx]
+    month_ints = month_values.astype(np.int64)
+    pair_keys = customer_codes * (month_ints.max() - month_ints.min() + 1) + (month_ints - month_ints.min())
+    first_idx = np.sort(np.unique(pair_keys, return_index=True)[1])
+    row_idx = row_idx[first_idx]
+    month_values = month_values[first_idx]
+    n_customers = len(np.unique(customer_codes[first_idx]))
+
+    # Construire la table colonne par colonne à partir des indices de transaction
+    # (le mois reste un datetime64, il n'est formaté qu'à l'affichage et à l'export ;
+    # la cohorte est catégorielle pour que les agrégations se fassent sur des codes entiers,
+    # et seuls les mois de début distincts sont formatés en texte)
+    cohort_months, cohort_positions = np.unique(journey_start_months, return_inverse=True)
+    cohort_labels = pd.Categorical(pd.DatetimeIndex(cohort_months.astype('datetime64[ns]')).strftime('%m/%Y'))
+    monthly_df = pd.DataFrame({
+        'customer_id': df['customer_id'].values[row_idx],
+        'subscription_id': df['subscription_id'].values[row_idx],
+        'mois': month_values.astype('datetime64[ns]'),
+        'mois_relatif': (month_values.view(np.int64) - journey_start_months.view(np.int64)[row_idx]).astype(np.int16),
+        'date_debut_parcours': pd.Categorical.from_codes(cohort_labels.codes[cohort_positions[row_idx]], cohort_labels.categories),
+        **{col: df[col].values[row_idx] for col in [
+            'frequence', 'type', 'payment_origin', 'psp', 'tm_source', 'tm_medium', 'tm_campaign',
+            'consolidated_revenues_ht_euro'
+        ]}
+    })
     
     print(f"✓ Table mensuelle créée: {len(monthly_df):,} lignes")
-    print(f"✓ Clients uniques: {monthly_df['customer_id'].nunique():,}")
+    print(f"✓ Clients uniques: {n_customers:,}")
     print(f"✓ Cohortes: {monthly_df['date_debut_parcours'].nunique()}")
     
     return monthly_df
@@ -146,32 +112,20 @@ def calculate_cohort_retention(monthly_df):
     """Calcule les taux de rétention par cohorte"""
     print("\n=== CALCUL DE LA RÉTENTION PAR COHORTE ===")
     
-    retention_results = []
+    # Clients actifs par cohorte et par mois relatif, en une seule agrégation
+    # (la table mensuelle est unique par client et par mois : un simple comptage suffit)
+    retention_df = (monthly_df.groupby(['date_debut_parcours', 'mois_relatif'], observed=True)
+                    .size().reset_index(name='clients_actifs'))
     
-    # Pour chaque cohorte
-    for cohort in monthly_df['date_debut_parcours'].unique():
-        cohort_data = monthly_df[monthly_df['date_debut_parcours'] == cohort]
-        
-        # Nombre de clients au mois 0
-        initial_customers = cohort_data[cohort_data['mois_relatif'] == 0]['customer_id'].nunique()
-        
-        if initial_customers == 0:
-            continue
-        
-        # Calculer la rétention pour chaque mois relatif
-        for month_rel in sorted(cohort_data['mois_relatif'].unique()):
-            active_customers = cohort_data[cohort_data['mois_relatif'] == month_rel]['customer_id'].nunique()
-            retention_rate = (active_customers / initial_customers) * 100
-            
-            retention_results.append({
-                'cohorte': cohort,
-                'mois_relatif': month_rel,
-                'clients_initiaux': initial_customers,
-                'clients_actifs': active_customers,
-                'taux_retention': round(retention_rate, 2)
-            })
-    
-    retention_df = pd.DataFrame(retention_results)
+    # Nombre de clients au mois 0 (les cohortes sans mois 0 sont écartées par la jointure)
+    initial_customers = (retention_df[retention_df['mois_relatif'] == 0]
+                         [['date_debut_parcours', 'clients_actifs']]
+                         .rename(columns={'clients_actifs': 'clients_initiaux'}))
+    retention_df = retention_df.merge(initial_customers, on='date_debut_parcours')
+    retention_df['taux_retention'] = (retention_df['clients_actifs'] / retention_df['clients_initiaux'] * 100).round(2)
+    
+    retention_df = retention_df.rename(columns={'date_debut_parcours': 'cohorte'})[
+        ['cohorte', 'mois_relatif', 'clients_initiaux', 'clients_actifs', 'taux_retention']]
     retention_df = retention_df.sort_values(['cohorte', 'mois_relatif'])
     
     print(f"✓ Analyse terminée: {len(retention_df):,} points de données")
@@ -182,17 +136,20 @@ def calculate_segmented_retention(monthly_df):
     """Calcule la rétention segmentée par différents critères"""
     print("\n=== ANALYSE DE RÉTENTION SEGMENTÉE ===")
     
-    # Nettoyer et préparer les segments
-    monthly_df_clean = monthly_df.copy()
+    # Nettoyer et préparer les segments (seules les colonnes utilisées sont conservées)
+    monthly_df_clean = monthly_df[['customer_id', 'date_debut_parcours', 'mois_relatif',
+                                   'frequence', 'tm_source', 'tm_medium']]
     
     # Nettoyer le PSP (null = CB)
-    monthly_df_clean['psp_clean'] = monthly_df_clean['psp'].fillna('CB')
-    
-    # Nettoyer les revenus (grouper par tranches)
-    monthly_df_clean['revenue_tranche'] = pd.cut(
-        monthly_df_clean['consolidated_revenues_ht_euro'].fillna(0),
-        bins=[0, 5, 10, 15, 20, float('inf')],
-        labels=['0-5€', '5-10€', '10-15€', '15-20€', '>20€']
+    psp = monthly_df['psp']
+    if 'CB' not in psp.cat.categories:
+        psp = psp.cat.add_categories('CB')
+    
+    # Nettoyer les revenus (grouper par tranches ]0-5], ]5-10], ..., >20 ; 0 ou négatif = hors tranche)
+    revenue_codes = np.searchsorted([0, 5, 10, 15, 20], monthly_df['consolidated_revenues_ht_euro'].fillna(0), side='left') - 1
+    monthly_df_clean = monthly_df_clean.assign(
+        psp_clean=psp.fillna('CB'),
+        revenue_tranche=pd.Categorical.from_codes(revenue_codes, ['0-5€', '5-10€', '10-15€', '15-20€', '>20€'])
     )
     
     segments = {
@@ -203,46 +160,37 @@ def calculate_segmented_retention(monthly_df):
         'revenue_tranche': 'revenue_tranche'
     }
     
+    # Passer les cinq colonnes de segmentation au format long pour une agrégation unique
+    id_columns = ['customer_id', 'date_debut_parcours', 'mois_relatif']
+    long_df = (monthly_df_clean[id_columns + list(segments.values())]
+               .rename(columns={column: segment_name for segment_name, column in segments.items()})
+               .melt(id_vars=id_columns, var_name='segment_type', value_name='segment_value')
+               .dropna(subset=['segment_value']))
+    
+    # Clients initiaux (mois 0) de chaque couple segment / cohorte, calculés en premier pour
+    # écarter les groupes trop petits avant l'agrégation complète (seuil de significativité)
+    group_columns = ['segment_type', 'segment_value', 'date_debut_parcours']
+    initial_customers = (long_df[long_df['mois_relatif'] == 0]
+                         .groupby(group_columns, observed=True).size().reset_index(name='clients_initiaux')
+                         .query('clients_initiaux >= 10'))
+    
+    # Clients actifs par type de segment, valeur, cohorte et mois relatif, sur les seuls groupes retenus
+    # (une seule ligne par client, mois et type de segment : un simple comptage suffit)
+    all_segments_df = (long_df.merge(initial_customers, on=group_columns)
+                       .groupby(group_columns + ['mois_relatif', 'clients_initiaux'], observed=True)
+                       .size().reset_index(name='clients_actifs'))
+    all_segments_df['taux_retention'] = (all_segments_df['clients_actifs'] / all_segments_df['clients_initiaux'] * 100).round(2)
+    all_segments_df = all_segments_df.rename(columns={'date_debut_parcours': 'cohorte'})[
+        ['segment_type', 'segment_value', 'cohorte', 'mois_relatif', 'clients_initiaux', 'clients_actifs', 'taux_retention']]
+    
     segmented_results = {}
     
-    for segment_name, column in segments.items():
+    for segment_name in segments:
         print(f"\nAnalyse par {segment_name}...")
-        segment_retention = []
-        
-        # Pour chaque valeur du segment
-        for segment_value in monthly_df_clean[column].dropna().unique():
-            if pd.isna(segment_value):
-                continue
-                
-            segment_data = monthly_df_clean[monthly_df_clean[column] == segment_value]
-            
-            # Pour chaque cohorte dans ce segment
-            for cohort in segment_data['date_debut_parcours'].unique():
-                cohort_segment_data = segment_data[segment_data['date_debut_parcours'] == cohort]
-                
-                # Clients initiaux (mois 0)
-                initial_customers = cohort_segment_data[cohort_segment_data['mois_relatif'] == 0]['customer_id'].nunique()
-                
-                if initial_customers < 10:  # Seuil minimum pour la significativité
-                    continue
-                
-                # Calculer la rétention pour chaque mois relatif
-                for month_rel in sorted(cohort_segment_data['mois_relatif'].unique()):
-                    active_customers = cohort_segment_data[cohort_segment_data['mois_relatif'] == month_rel]['customer_id'].nunique()
-                    retention_rate = (active_customers / initial_customers) * 100
-                    
-                    segment_retention.append({
-                        'segment_type': segment_name,
-                        'segment_value': segment_value,
-                        'cohorte': cohort,
-                        'mois_relatif': month_rel,
-                        'clients_initiaux': initial_customers,
-                        'clients_actifs': active_customers,
-                        'taux_retention': round(retention_rate, 2)
-                    })
+        segment_df = all_segments_df[all_segments_df['segment_type'] == segment_name]
         
-        if segment_retention:
-            segmented_results[segment_name] = pd.DataFrame(segment_retention)
+        if not segment_df.empty:
+            segmented_results[segment_name] = segment_df.reset_index(drop=True)
             
             # Afficher un résumé pour ce segment
             summary = segmented_results[segment_name].groupby(['segment_value', 'mois_relatif']).agg({
@@ -293,37 +241,20 @@ def create_cohort_summary(retention_df):
     """Crée un résumé par cohorte avec les métriques clés"""
     print("\n=== RÉSUMÉ PAR COHORTE ===")
     
-    cohort_summary = []
+    # Taille initiale et durée de suivi de chaque cohorte
+    summary_df = retention_df.groupby('cohorte', observed=True).agg(
+        taille_initiale=('clients_initiaux', 'first'),
+        duree_suivi=('mois_relatif', 'max')
+    )
     
-    for cohort in retention_df['cohorte'].unique():
-        cohort_data = retention_df[retention_df['cohorte'] == cohort]
-        initial_size = cohort_data['clients_initiaux'].iloc[0]
-        
-        # Extraire les taux de rétention pour différents mois
-        retention_1m = cohort_data[cohort_data['mois_relatif'] == 1]['taux_retention'].values
-        retention_3m = cohort_data[cohort_data['mois_relatif'] == 3]['taux_retention'].values
-        retention_6m = cohort_data[cohort_data['mois_relatif'] == 6]['taux_retention'].values
-        retention_12m = cohort_data[cohort_data['mois_relatif'] == 12]['taux_retention'].values
-        retention_13m = cohort_data[cohort_data['mois_relatif'] == 13]['taux_retention'].values
-        retention_18m = cohort_data[cohort_data['mois_relatif'] == 18]['taux_retention'].values
-        retention_24m = cohort_data[cohort_data['mois_relatif'] == 24]['taux_retention'].values
-        retention_25m = cohort_data[cohort_data['mois_relatif'] == 25]['taux_retention'].values
-        
-        cohort_summary.append({
-            'cohorte': cohort,
-            'taille_initiale': initial_size,
-            'retention_1m': retention_1m[0] if len(retention_1m) > 0 else np.nan,
-            'retention_3m': retention_3m[0] if len(retention_3m) > 0 else np.nan,
-            'retention_6m': retention_6m[0] if len(retention_6m) > 0 else np.nan,
-            'retention_12m': retention_12m[0] if len(retention_12m) > 0 else np.nan,
-            'retention_13m': retention_13m[0] if len(retention_13m) > 0 else np.nan,
-            'retention_18m': retention_18m[0] if len(retention_18m) > 0 else np.nan,
-            'retention_24m': retention_24m[0] if len(retention_24m) > 0 else np.nan,
-            'retention_25m': retention_25m[0] if len(retention_25m) > 0 else np.nan,
-            'duree_suivi': cohort_data['mois_relatif'].max()
-        })
-    
-    summary_df = pd.DataFrame(cohort_summary)
+    # Taux de rétention des mois clés, un mois par colonne (NaN si le mois n'est pas encore atteint)
+    key_months = [1, 3, 6, 12, 13, 18, 24, 25]
+    key_rates = (retention_df.pivot(index='cohorte', columns='mois_relatif', values='taux_retention')
+                 .reindex(columns=key_months))
+    key_rates.columns = [f'retention_{month}m' for month in key_months]
+    
+    summary_df = summary_df.join(key_rates).reset_index()
+    summary_df = summary_df[['cohorte', 'taille_initiale'] + list(key_rates.columns) + ['duree_suivi']]
     summary_df = summary_df.sort_values('cohorte')
     
     # Afficher les principales cohortes
@@ -356,43 +287,22 @@ def create_segment_summary(segmented_results):
         print(f"\n{segment_name.upper()}:")
         print("-" * 40)
         
-        # Calculer les moyennes par segment pour les mois clés
-        summary_data = []
+        # Taille totale de chaque segment (clients au mois 0, toutes cohortes confondues)
+        total_clients = (segment_df[segment_df['mois_relatif'] == 0]
+                         .groupby('segment_value', sort=False)['clients_initiaux'].sum())
         
-        for segment_value in segment_df['segment_value'].unique():
-            segment_subset = segment_df[segment_df['segment_value'] == segment_value]
-            
-            # Taille totale du segment
-            total_clients = segment_subset[segment_subset['mois_relatif'] == 0]['clients_initiaux'].sum()
-            
-            if total_clients < 50:  # Filtrer les segments trop petits
-                continue
-            
-            # Moyennes de rétention pour les mois clés
-            retention_1m = segment_subset[segment_subset['mois_relatif'] == 1]['taux_retention'].mean()
-            retention_3m = segment_subset[segment_subset['mois_relatif'] == 3]['taux_retention'].mean()
-            retention_6m = segment_subset[segment_subset['mois_relatif'] == 6]['taux_retention'].mean()
-            retention_12m = segment_subset[segment_subset['mois_relatif'] == 12]['taux_retention'].mean()
-            retention_13m = segment_subset[segment_subset['mois_relatif'] == 13]['taux_retention'].mean()
-            retention_18m = segment_subset[segment_subset['mois_relatif'] == 18]['taux_retention'].mean()
-            retention_24m = segment_subset[segment_subset['mois_relatif'] == 24]['taux_retention'].mean()
-            retention_25m = segment_subset[segment_subset['mois_relatif'] == 25]['taux_retention'].mean()
-            
-            summary_data.append({
-                'segment': str(segment_value)[:20],  # Tronquer pour l'affichage
-                'total_clients': total_clients,
-                'retention_1m': retention_1m,
-                'retention_3m': retention_3m,
-                'retention_6m': retention_6m,
-                'retention_12m': retention_12m,
-                'retention_13m': retention_13m,
-                'retention_18m': retention_18m,
-                'retention_24m': retention_24m,
-                'retention_25m': retention_25m
-            })
+        # Moyennes de rétention pour les mois clés, un mois par colonne
+        key_months = [1, 3, 6, 12, 13, 18, 24, 25]
+        summary = (segment_df.pivot_table(index='segment_value', columns='mois_relatif', values='taux_retention', aggfunc='mean')
+                   .reindex(index=total_clients.index, columns=key_months))
+        summary.columns = [f'retention_{month}m' for month in key_months]
+        summary.insert(0, 'total_clients', total_clients)
+        summary.insert(0, 'segment', summary.index.astype(str).str[:20])  # Tronquer pour l'affichage
         
-        # Trier par rétention 24M et afficher
-        summary_data = sorted(summary_data, key=lambda x: x['retention_24m'] if not pd.isna(x['retention_24m']) else 0, reverse=True)
+        # Filtrer les segments trop petits, trier par rétention 24M et afficher
+        summary = summary[summary['total_clients'] >= 50]
+        summary = summary.sort_values('retention_24m', ascending=False, kind='stable', key=lambda rates: rates.fillna(0))
+        summary_data = summary.to_dict('records')
         
         print("Segment\t\t\tClients\t1M\t3M\t6M\t12M\t13M\t18M\t24M\t25M")
         print("-" * 95)
@@ -413,38 +323,50 @@ def create_segment_summary(segmented_results):
     return segment_summaries
 
 def export_results(monthly_df, retention_df, summary_df, segmented_results, segment_summaries, output_file='analyse_retention_segmentee.xlsx'):
-    """Exporte tous les résultats dans un fichier Excel avec segmentation"""
+    """Exporte les tables détaillées en Parquet et les résultats dans un fichier Excel avec segmentation"""
     print(f"\n=== EXPORT VERS {output_file} ===")
     
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        # 1. Table mensuelle (échantillon)
-        monthly_df.head(10000).to_excel(writer, sheet_name='Table_Mensuelle', index=False)
-        
-        # 2. Table de rétention globale par cohorte
-        retention_df.to_excel(writer, sheet_name='Retention_Globale', index=False)
+    # Tables détaillées en Parquet (un fichier par table, dans un dossier portant le nom du classeur)
+    parquet_dir = os.path.splitext(output_file)[0]
+    os.makedirs(parquet_dir, exist_ok=True)
+    
+    parquet_tables = {
+        'Table_Mensuelle': monthly_df,
+        'Retention_Globale': retention_df,
+        'Resume_Cohortes': summary_df
+    }
+    for segment_name, segment_df in segmented_results.items():
+        parquet_tables[f'Retention_{segment_name.capitalize()}'[:31]] = segment_df
+    
+    for table_name, table_df in parquet_tables.items():
+        table_df.to_parquet(os.path.join(parquet_dir, f'{table_name}.parquet'), index=False, compression='zstd')
+    
+    with xlsxwriter.Workbook(output_file, {'constant_memory': True}) as workbook:
+        # 1. Table de rétention globale par cohorte
+        write_excel_sheet(workbook, 'Retention_Globale', retention_df)
         
-        # 3. Résumé par cohorte
-        summary_df.to_excel(writer, sheet_name='Resume_Cohortes', index=False)
+        # 2. Résumé par cohorte
+        write_excel_sheet(workbook, 'Resume_Cohortes', summary_df)
         
-        # 4. Moyennes de rétention globales
+        # 3. Moyennes de rétention globales
         avg_by_month = retention_df.groupby('mois_relatif').agg({
             'taux_retention': 'mean',
             'clients_initiaux': 'sum'
         }).round(2)
-        avg_by_month.to_excel(writer, sheet_name='Moyennes_Globales')
+        write_excel_sheet(workbook, 'Moyennes_Globales', avg_by_month.reset_index())
         
-        # 5. Résultats segmentés
+        # 4. Résultats segmentés
         for segment_name, segment_df in segmented_results.items():
             sheet_name = f'Retention_{segment_name.capitalize()}'[:31]  # Limite Excel
-            segment_df.to_excel(writer, sheet_name=sheet_name, index=False)
+            write_excel_sheet(workbook, sheet_name, segment_df)
         
-        # 6. Résumés des segments
+        # 5. Résumés des segments
         for segment_name, summary_data in segment_summaries.items():
             if summary_data:
                 sheet_name = f'Resume_{segment_name.capitalize()}'[:31]
-                pd.DataFrame(summary_data).to_excel(writer, sheet_name=sheet_name, index=False)
+                write_excel_sheet(workbook, sheet_name, pd.DataFrame(summary_data))
         
-        # 7. Analyse comparative des segments
+        # 6. Analyse comparative des segments
         comparative_data = []
         for segment_name, summary_data in segment_summaries.items():
             for item in summary_data[:5]:  # Top 5 de chaque segment
@@ -460,9 +382,10 @@ def export_results(monthly_df, retention_df, summary_df, segmented_results, segm
                 })
         
         if comparative_data:
-            pd.DataFrame(comparative_data).to_excel(writer, sheet_name='Comparatif_Segments', index=False)
+            write_excel_sheet(workbook, 'Comparatif_Segments', pd.DataFrame(comparative_data))
     
     print(f"✓ Résultats exportés vers {output_file}")
+    print(f"  - {len(parquet_tables)} tables détaillées en Parquet dans {parquet_dir}/")
     print(f"  - {len(segmented_results)} analyses segmentées")
     print(f"  - {sum(len(s) for s in segment_summaries.values())} segments analysés")
 
@@ -471,8 +394,9 @@ def analyze_revenue_correlation(monthly_df):
     print("\n=== ANALYSE REVENUS / RÉTENTION ===")
     
     # Créer des tranches de revenus plus détaillées
-    monthly_df_revenue = monthly_df.copy()
-    monthly_df_revenue['revenue_clean'] = monthly_df_revenue['consolidated_revenues_ht_euro'].fillna(0)
+    monthly_df_revenue = monthly_df[['customer_id', 'mois_relatif']].assign(
+        revenue_clean=monthly_df['consolidated_revenues_ht_euro'].fillna(0)
+    )
     
     # Statistiques des revenus
     revenue_stats = monthly_df_revenue['revenue_clean'].describe()
@@ -482,10 +406,11 @@ def analyze_revenue_correlation(monthly_df):
     print(f"  Écart-type: {revenue_stats['std']:.2f}€")
     
     # Analyse par tranche de revenus
-    monthly_df_revenue['revenue_quartile'] = pd.qcut(
-        monthly_df_revenue['revenue_clean'], 
-        q=4, 
-        labels=['Q1 (Bas)', 'Q2 (Moyen-)', 'Q3 (Moyen+)', 'Q4 (Élevé)']
+    # (bornes des quartiles calculées une fois, affectation par recherche dichotomique sans tri complet)
+    quartile_edges = np.quantile(monthly_df_revenue['revenue_clean'], [0.25, 0.5, 0.75])
+    monthly_df_revenue['revenue_quartile'] = pd.Categorical.from_codes(
+        np.searchsorted(quartile_edges, monthly_df_revenue['revenue_clean'], side='left'),
+        ['Q1 (Bas)', 'Q2 (Moyen-)', 'Q3 (Moyen+)', 'Q4 (Élevé)']
     )
     
     print("\nRétention par quartile de revenus:")
@@ -547,7 +472,7 @@ def main():
         print(f"- Clients analysés: {monthly_df['customer_id'].nunique():,}")
         print(f"- Cohortes identifiées: {retention_df['cohorte'].nunique()}")
         print(f"- Segments analysés: {len(segmented_results)}")
-        print(f"- Période d'analyse: {monthly_df['mois'].min()} à {monthly_df['mois'].max()}")
+        print(f"- Période d'analyse: {monthly_df['mois'].min().strftime('%m/%Y')} à {monthly_df['mois'].max().strftime('%m/%Y')}")
         
         # Moyennes globales
         if len(significant_data) > 0:
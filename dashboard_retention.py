@@ -5,30 +5,93 @@ Dashboard Local - Analyse de Rétention des Abonnés
 Ce script crée un tableau de bord web interactif en local avec Plotly Dash
 """
 
+import hashlib
+import os
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.io as pio
 from plotly.subplots import make_subplots
 import dash
 from dash import dcc, html, Input, Output, callback_context
 import dash_bootstrap_components as dbc
 from datetime import datetime
+from contextlib import ExitStack
+from functools import lru_cache
+import logging
 import warnings
 warnings.filterwarnings('ignore')
 
+# Sérialiser les figures avec orjson quand il est installé (encodeur C, gère directement les tableaux numpy)
+try:
+    import orjson  # noqa: F401
+    pio.json.config.default_engine = 'orjson'
+except ImportError:
+    pass
+
+# Diagnostics des calculs en niveau DEBUG (silencieux par défaut)
+logger = logging.getLogger(__name__)
+
 # Configuration
 DATA_FILE = 'analyse_retention_segmentee.xlsx'
+PARQUET_DIR = os.path.splitext(DATA_FILE)[0]  # Tables Parquet écrites à côté du fichier Excel par l'analyse
+CACHE_DIR = '.cache'  # Copies Feather des onglets Excel, relues tant que le fichier Excel n'a pas changé
+SEGMENT_COLUMNS = ['segment_value', 'cohorte', 'mois_relatif', 'clients_initiaux', 'clients_actifs', 'taux_retention']
+SEGMENT_DTYPES = {'segment_value': str, 'cohorte': str, 'mois_relatif': 'int32',
+                  'clients_initiaux': 'int32', 'clients_actifs': 'int32', 'taux_retention': 'float32'}
 PORT = 8050
 
+# Date limite des cohortes retenues pour chaque filtre ('all' : toutes les cohortes)
+COHORT_CUTOFFS = {
+    '2023-12': pd.Timestamp('2023-12-01'),
+    '2023-06': pd.Timestamp('2023-06-01'),
+    '2022-12': pd.Timestamp('2022-12-01'),
+    '2022-06': pd.Timestamp('2022-06-01')
+}
+
+def read_retention_table(sheet_name, columns=None, dtype=None, open_excel_file=None):
+    """Lit une table depuis son fichier Parquet, ou depuis l'onglet Excel (mis en cache) si le Parquet est absent
+    (open_excel_file : fonction renvoyant le classeur déjà ouvert, partagé entre les onglets d'un chargement)"""
+    parquet_file = os.path.join(PARQUET_DIR, f'{sheet_name}.parquet')
+    if os.path.exists(parquet_file):
+        table = pd.read_parquet(parquet_file, columns=columns)
+        # Les cohortes sont stockées en catégories : les repasser en texte, comme dans l'onglet Excel
+        return table.astype({col: str for col in table.select_dtypes(include='category').columns})
+    
+    # Onglet Excel déjà mis en cache et plus récent que le fichier Excel : le cache ne contient que les colonnes
+    # et types demandés, d'où un fichier par sélection (colonnes, types) de l'onglet
+    selection = hashlib.md5(repr((columns, dtype)).encode()).hexdigest()[:12]
+    cache_file = os.path.join(CACHE_DIR, f'{sheet_name}_{selection}.feather')
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(DATA_FILE):
+        return pd.read_feather(cache_file)
+    
+    # Seules les colonnes utiles sont converties, directement dans leur type final
+    with ExitStack() as fichiers_ouverts:
+        excel_file = open_excel_file() if open_excel_file else fichiers_ouverts.enter_context(pd.ExcelFile(DATA_FILE))
+        table = pd.read_excel(excel_file, sheet_name=sheet_name, usecols=columns, dtype=dtype)
+    try:
+        # Écriture dans un fichier temporaire puis renommage, pour ne jamais laisser un cache partiel
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        table.to_feather(f'{cache_file}.tmp', compression='lz4')
+        os.replace(f'{cache_file}.tmp', cache_file)
+    except Exception as e:
+        print(f"⚠️ Cache non écrit pour {sheet_name}: {e}")
+    
+    return table
+
 def load_retention_data():
-    """Charge les données d'analyse de rétention depuis le fichier Excel"""
+    """Charge les données d'analyse de rétention (Parquet, ou Excel à défaut)"""
     print("Chargement des données de rétention...")
     
+    # Classeur Excel ouvert seulement si un onglet doit y être lu, une seule fois pour tous les onglets,
+    # puis refermé en fin de chargement (les onglets lus restent disponibles dans le cache Feather)
+    fichiers_ouverts = ExitStack()
+    open_excel_file = lru_cache(maxsize=1)(lambda: fichiers_ouverts.enter_context(pd.ExcelFile(DATA_FILE)))
     try:
         # Charger les différents onglets
-        retention_global = pd.read_excel(DATA_FILE, sheet_name='Retention_Globale')
-        resume_cohortes = pd.read_excel(DATA_FILE, sheet_name='Resume_Cohortes')
+        retention_global = read_retention_table('Retention_Globale', columns=['cohorte', 'mois_relatif', 'taux_retention'], open_excel_file=open_excel_file)
+        resume_cohortes = read_retention_table('Resume_Cohortes', open_excel_file=open_excel_file)
         
         # Charger les données segmentées
         segments_data = {}
@@ -37,10 +100,14 @@ def load_retention_data():
         
         for segment_name in segment_names:
             try:
-                segment_df = pd.read_excel(DATA_FILE, sheet_name=segment_name)
+                segment_df = read_retention_table(segment_name, columns=SEGMENT_COLUMNS, dtype=SEGMENT_DTYPES, open_excel_file=open_excel_file)
                 segments_data[segment_name] = segment_df
                 print(f"✓ {segment_name}: {len(segment_df)} lignes, colonnes: {list(segment_df.columns)}")
                 
+                # Convertir les cohortes en dates une fois pour toutes (utilisées par le filtre de cohorte)
+                if 'cohorte' in segment_df.columns:
+                    segment_df['cohorte_date'] = pd.to_datetime(segment_df['cohorte'], format='%m/%Y', errors='coerce')
+                
                 # Afficher les valeurs uniques de segment_value
                 if 'segment_value' in segment_df.columns:
                     unique_values = segment_df['segment_value'].unique()
@@ -51,6 +118,15 @@ def load_retention_data():
             except Exception as e:
                 print(f"⚠️ Onglet {segment_name} non trouvé: {e}")
         
+        # Réduire les types des tables segmentées (entiers et flottants au plus juste, textes en catégories)
+        for segment_df in segments_data.values():
+            for col in segment_df.columns.intersection(['mois_relatif', 'clients_initiaux', 'clients_actifs']):
+                segment_df[col] = pd.to_numeric(segment_df[col], downcast='integer')
+            if 'taux_retention' in segment_df.columns:
+                segment_df['taux_retention'] = pd.to_numeric(segment_df['taux_retention'], downcast='float')
+            for col in segment_df.columns.intersection(['segment_value', 'cohorte']):
+                segment_df[col] = segment_df[col].astype('category')
+        
         print(f"✓ Données chargées: {len(retention_global)} lignes de rétention globale")
         print(f"✓ {len(resume_cohortes)} cohortes analysées")
         print(f"✓ {len(segments_data)} segments chargés")
@@ -62,180 +138,130 @@ def load_retention_data():
         print(f"Détail: {e}")
         print("\nAssurez-vous d'avoir d'abord exécuté le script d'analyse de rétention.")
         return None, None, None
+    finally:
+        fichiers_ouverts.close()
 
 def prepare_retention_chart_data(retention_df, selected_cohort='all'):
     """Prépare les données pour le graphique de rétention"""
     if retention_df is None or retention_df.empty:
         return []
     
-    months = list(range(26))  # 0 à 25 mois
-    chart_data = []
+    if selected_cohort == 'all':
+        # Moyenne de toutes les cohortes, pour tous les mois en une seule agrégation
+        rates = retention_df.groupby('mois_relatif')['taux_retention'].mean().round(2)
+        rate_key = 'retention_moyenne'
+    else:
+        # Cohorte spécifique (premier point de chaque mois)
+        cohort_data = retention_df[retention_df['cohorte'] == selected_cohort]
+        rates = cohort_data.drop_duplicates('mois_relatif').set_index('mois_relatif')['taux_retention']
+        rate_key = selected_cohort
     
-    for month in months:
+    # 0 à 25 mois (un mois sans données n'a que son numéro)
+    chart_data = []
+    for month in range(26):
         month_data = {'mois_relatif': month}
-        
-        if selected_cohort == 'all':
-            # Moyenne de toutes les cohortes
-            cohort_data = retention_df[retention_df['mois_relatif'] == month]
-            if not cohort_data.empty:
-                avg_retention = cohort_data['taux_retention'].mean()
-                month_data['retention_moyenne'] = round(avg_retention, 2)
-        else:
-            # Cohorte spécifique
-            cohort_data = retention_df[
-                (retention_df['cohorte'] == selected_cohort) & 
-                (retention_df['mois_relatif'] == month)
-            ]
-            if not cohort_data.empty:
-                month_data[selected_cohort] = cohort_data['taux_retention'].iloc[0]
-        
+        if month in rates.index:
+            month_data[rate_key] = rates[month]
         chart_data.append(month_data)
     
     return chart_data
 
 def prepare_segment_evolution_data(segments_data, segment_type, cohort_filter='all'):
     """Prépare les données pour l'évolution de la rétention par segment avec filtre de cohorte"""
-    print(f"\n=== DIAGNOSTIC {segment_type} (Filtre: {cohort_filter}) ===")
+    debug = logger.isEnabledFor(logging.DEBUG)  # Les diagnostics coûteux ne sont calculés qu'en DEBUG
+    logger.debug(f"=== DIAGNOSTIC {segment_type} (Filtre: {cohort_filter}) ===")
     
     if segment_type not in segments_data:
-        print(f"❌ Segment {segment_type} non trouvé")
-        return [], []
+        logger.warning(f"❌ Segment {segment_type} non trouvé")
+        return {}, []
     
-    segment_df = segments_data[segment_type].copy()
-    print(f"✓ Données initiales: {len(segment_df)} lignes")
+    segment_df = segments_data[segment_type]  # lecture seule : chaque filtrage crée un nouveau DataFrame
+    logger.debug(f"✓ Données initiales: {len(segment_df)} lignes")
     
     # ÉTAPE 1: FILTRER LES COHORTES D'ABORD
+    max_months = 25  # On peut voir jusqu'à M25 quel que soit le filtre
     if cohort_filter != 'all':
-        try:
-            if 'cohorte' in segment_df.columns:
-                segment_df['cohorte_date'] = pd.to_datetime(segment_df['cohorte'], format='%m/%Y')
-                
-                # Définir la date limite selon le filtre
-                if cohort_filter == '2023-12':
-                    cutoff_date = pd.to_datetime('2023-12-01')
-                    max_months = 25  # On peut voir jusqu'à M25 avec ces cohortes
-                elif cohort_filter == '2023-06':
-                    cutoff_date = pd.to_datetime('2023-06-01')
-                    max_months = 25
-                elif cohort_filter == '2022-12':
-                    cutoff_date = pd.to_datetime('2022-12-01')
-                    max_months = 25
-                elif cohort_filter == '2022-06':
-                    cutoff_date = pd.to_datetime('2022-06-01')
-                    max_months = 25
-                else:
-                    cutoff_date = pd.to_datetime('2099-12-01')
-                    max_months = 25
-                
-                # FILTRER UNIQUEMENT LES COHORTES (pas les mois)
-                cohortes_avant = segment_df['cohorte'].nunique()
-                segment_df = segment_df[segment_df['cohorte_date'] <= cutoff_date]
-                cohortes_apres = segment_df['cohorte'].nunique()
-                
-                print(f"✓ Cohortes filtrées: {cohortes_avant} → {cohortes_apres} cohortes")
-                print(f"✓ Données après filtrage cohorte: {len(segment_df)} lignes")
+        if 'cohorte_date' in segment_df.columns:
+            # Date limite selon le filtre (dates de cohorte déjà converties au chargement)
+            cutoff_date = COHORT_CUTOFFS.get(cohort_filter, pd.Timestamp('2099-12-01'))
+            
+            # FILTRER UNIQUEMENT LES COHORTES (pas les mois)
+            cohortes_avant = segment_df['cohorte'].nunique() if debug else None
+            segment_df = segment_df[segment_df['cohorte_date'] <= cutoff_date]
+            
+            if debug:
+                logger.debug(f"✓ Cohortes filtrées: {cohortes_avant} → {segment_df['cohorte'].nunique()} cohortes")
+                logger.debug(f"✓ Données après filtrage cohorte: {len(segment_df)} lignes")
                 
                 # Afficher les cohortes retenues
                 cohortes_retenues = sorted(segment_df['cohorte'].unique())
-                print(f"✓ Cohortes retenues: {cohortes_retenues[:5]}...{cohortes_retenues[-3:] if len(cohortes_retenues) > 8 else ''}")
-            else:
-                print("⚠️ Colonne 'cohorte' non trouvée, pas de filtrage possible")
-                max_months = 25
-        except Exception as e:
-            print(f"⚠️ Erreur lors du filtrage: {e}")
-            max_months = 25
-    else:
-        max_months = 25
+                logger.debug(f"✓ Cohortes retenues: {cohortes_retenues[:5]}...{cohortes_retenues[-3:] if len(cohortes_retenues) > 8 else ''}")
+        else:
+            logger.warning("⚠️ Colonne 'cohorte' non trouvée, pas de filtrage possible")
     
     # ÉTAPE 2: NETTOYER LES DONNÉES
     required_cols = ['segment_value', 'mois_relatif', 'clients_initiaux', 'clients_actifs']
     for col in required_cols:
         if col not in segment_df.columns:
-            print(f"❌ Colonne '{col}' manquante!")
-            return [], []
+            logger.warning(f"❌ Colonne '{col}' manquante!")
+            return {}, []
     
-    segment_df = segment_df[segment_df['clients_initiaux'] > 0]
-    segment_df = segment_df[segment_df['clients_actifs'] >= 0]
-    segment_df = segment_df[segment_df['mois_relatif'] <= max_months]
+    # Un seul masque combiné plutôt que trois filtrages successifs
+    segment_df = segment_df[(segment_df['clients_initiaux'].values > 0) &
+                            (segment_df['clients_actifs'].values >= 0) &
+                            (segment_df['mois_relatif'].values <= max_months)]
     
-    print(f"✓ Données nettoyées: {len(segment_df)} lignes valides")
+    logger.debug(f"✓ Données nettoyées: {len(segment_df)} lignes valides")
     
     # ÉTAPE 3: RECALCULER LES TOTAUX PAR SEGMENT AVEC LES COHORTES FILTRÉES
-    print(f"\n--- RECALCUL DES TOTAUX AVEC COHORTES FILTRÉES ---")
+    logger.debug("--- RECALCUL DES TOTAUX AVEC COHORTES FILTRÉES ---")
     
     # Identifier les segments principaux par taille (APRÈS filtrage)
-    segment_sizes = segment_df[segment_df['mois_relatif'] == 0].groupby('segment_value')['clients_initiaux'].sum()
+    segment_sizes = segment_df[segment_df['mois_relatif'] == 0].groupby('segment_value', observed=True)['clients_initiaux'].sum()
     main_segments = segment_sizes.nlargest(3).index.tolist()
     
-    print(f"✓ Top 3 segments (après filtrage): {main_segments}")
-    for seg in main_segments:
-        size = segment_sizes[seg]
-        print(f"  - {seg}: {size:,} clients")
+    if debug:
+        logger.debug(f"✓ Top 3 segments (après filtrage): {main_segments}")
+        for seg in main_segments:
+            logger.debug(f"  - {seg}: {segment_sizes[seg]:,} clients")
     
     if not main_segments:
-        return [], []
+        return {}, []
     
     # ÉTAPE 4: CALCULER L'ÉVOLUTION POUR CHAQUE MOIS
-    evolution_data = []
-    months = list(range(0, max_months + 1))
-    
-    for month in months:
-        month_data = {'mois_relatif': month}
-        
-        for segment_value in main_segments:
-            # 1. TOTAL clients initiaux pour ce segment (M0, toutes cohortes filtrées)
-            initial_data = segment_df[
-                (segment_df['segment_value'] == segment_value) & 
-                (segment_df['mois_relatif'] == 0)
-            ]
-            
-            if initial_data.empty:
-                month_data[str(segment_value)] = None
-                continue
-                
-            total_initial = initial_data['clients_initiaux'].sum()
-            
-            # 2. TOTAL clients actifs pour ce segment à ce mois (toutes cohortes filtrées)
-            month_data_seg = segment_df[
-                (segment_df['segment_value'] == segment_value) & 
-                (segment_df['mois_relatif'] == month)
-            ]
-            
-            if month_data_seg.empty:
-                month_data[str(segment_value)] = None
-                continue
-            
-            total_active = month_data_seg['clients_actifs'].sum()
-            
-            # 3. Calculer la rétention sur le nouveau bassin
-            if total_initial > 0:
-                retention_rate = (total_active / total_initial) * 100
-                retention_rate = min(retention_rate, 100.0)
-                
-                if month == 0:
-                    retention_rate = 100.0
-                
-                month_data[str(segment_value)] = round(retention_rate, 1)
-                
-                # Debug pour certains mois
-                if month in [0, 6, 12, 18, 24] and month <= max_months:
-                    print(f"  {segment_value} M{month}: {total_active:,}/{total_initial:,} = {retention_rate:.1f}%")
-            else:
-                month_data[str(segment_value)] = None
-        
-        evolution_data.append(month_data)
+    # Total des clients actifs par mois et par segment (toutes cohortes filtrées), en une seule agrégation
+    active_by_month = (segment_df[segment_df['segment_value'].isin(main_segments)]
+                       .groupby(['mois_relatif', 'segment_value'], observed=True)['clients_actifs'].sum()
+                       .unstack('segment_value')
+                       .reindex(index=range(max_months + 1), columns=main_segments))
+    
+    # Rétention sur le bassin initial (M0, toutes cohortes filtrées), plafonnée à 100% et fixée à 100% à M0
+    initial_by_segment = segment_sizes[main_segments]
+    retention = (active_by_month / initial_by_segment * 100).clip(upper=100.0)
+    retention.loc[0] = retention.loc[0].where(retention.loc[0].isna(), 100.0)
+    
+    # Debug pour certains mois
+    if debug:
+        for month in [0, 6, 12, 18, 24]:
+            if month <= max_months:
+                for segment_value in main_segments:
+                    if not pd.isna(retention.at[month, segment_value]):
+                        logger.debug(f"  {segment_value} M{month}: {int(active_by_month.at[month, segment_value]):,}/"
+                                     f"{initial_by_segment[segment_value]:,} = {retention.at[month, segment_value]:.1f}%")
+    
+    # Données en colonnes : les mois, puis un tableau de taux par segment (NaN si pas de données)
+    evolution_data = {'mois_relatif': retention.index.to_numpy()}
+    for segment_value in main_segments:
+        evolution_data[str(segment_value)] = retention[segment_value].to_numpy(dtype=float).round(1)
     
     # ÉTAPE 5: VALIDATION FINALE (lissage optionnel)
-    for segment in main_segments:
-        values = []
-        
-        for item in evolution_data:
-            val = item.get(str(segment))
-            if val is not None:
-                values.append(val)
-        
-        if len(values) > 1:
-            print(f"✓ {segment}: {len(values)} points, range {min(values):.1f}%-{max(values):.1f}%")
+    if debug:
+        for segment in main_segments:
+            values = evolution_data[str(segment)]
+            values = values[~np.isnan(values)]
+            
+            if len(values) > 1:
+                logger.debug(f"✓ {segment}: {len(values)} points, range {values.min():.1f}%-{values.max():.1f}%")
     
     return evolution_data, main_segments
 
@@ -255,23 +281,19 @@ def create_segment_evolution_chart(evolution_data, main_segments, segment_type):
     fig = go.Figure()
     colors = ['#3B82F6', '#10B981', '#F59E0B']  # Bleu, Vert, Orange
     
+    months = evolution_data['mois_relatif']
+    
     for i, segment in enumerate(main_segments):
-        x_values = []
-        y_values = []
-        
-        # Collecter les points valides
-        for item in evolution_data:
-            value = item.get(str(segment))
-            if value is not None and 0 <= value <= 100:
-                x_values.append(item['mois_relatif'])
-                y_values.append(value)
+        # Garder les points valides (les NaN échouent aux deux comparaisons)
+        values = evolution_data[str(segment)]
+        valid = (values >= 0) & (values <= 100)
         
-        if len(x_values) >= 3:  # Minimum 3 points pour une courbe
+        if valid.sum() >= 3:  # Minimum 3 points pour une courbe
             fig.add_trace(go.Scatter(
-                x=x_values,
-                y=y_values,
+                x=months[valid],
+                y=values[valid],
                 mode='lines+markers',
-                name=f'{segment.title()} ({len(x_values)} mois)',
+                name=f'{segment.title()} ({valid.sum()} mois)',
                 line=dict(color=colors[i % len(colors)], width=3),
                 marker=dict(size=5),
                 connectgaps=False
@@ -302,49 +324,6 @@ def create_segment_evolution_chart(evolution_data, main_segments, segment_type):
                   annotation_text="Départ (100%)")
     
     return fig
-    """Prépare les données pour l'évolution de la rétention par segment"""
-    if segment_type not in segments_data:
-        print(f"Segment {segment_type} non trouvé dans les données")
-        return [], []
-    
-    segment_df = segments_data[segment_type]
-    print(f"Traitement du segment {segment_type} avec {len(segment_df)} lignes")
-    
-    # Identifier les segments principaux (avec suffisamment de données)
-    segment_sizes = segment_df.groupby('segment_value')['clients_initiaux'].sum()
-    print(f"Tailles des segments: {segment_sizes.to_dict()}")
-    
-    # Prendre tous les segments avec au moins 20 clients
-    main_segments = segment_sizes[segment_sizes >= 20].index.tolist()
-    print(f"Segments principaux retenus: {main_segments}")
-    
-    if not main_segments:
-        return [], []
-    
-    evolution_data = []
-    months = list(range(0, 26))  # 0 à 25 mois
-    
-    for month in months:
-        month_data = {'mois_relatif': month}
-        
-        for segment_value in main_segments:
-            segment_month_data = segment_df[
-                (segment_df['segment_value'] == segment_value) & 
-                (segment_df['mois_relatif'] == month)
-            ]
-            
-            if not segment_month_data.empty:
-                # Moyenne pondérée par le nombre de clients
-                total_clients = segment_month_data['clients_initiaux'].sum()
-                weighted_retention = (segment_month_data['taux_retention'] * segment_month_data['clients_initiaux']).sum() / total_clients if total_clients > 0 else 0
-                month_data[str(segment_value)] = round(weighted_retention, 2)
-            else:
-                month_data[str(segment_value)] = None
-        
-        evolution_data.append(month_data)
-    
-    print(f"Données d'évolution générées pour {len(evolution_data)} mois")
-    return evolution_data, main_segments
 
 def prepare_segment_data(segments_data, segment_type):
     """Prépare les données pour l'analyse par segment (barres)"""
@@ -353,34 +332,22 @@ def prepare_segment_data(segments_data, segment_type):
     
     segment_df = segments_data[segment_type]
     
-    # Calculer les moyennes par segment pour les mois clés
-    summary_data = []
-    
-    for segment_value in segment_df['segment_value'].unique():
-        segment_subset = segment_df[segment_df['segment_value'] == segment_value]
-        
-        # Taille totale du segment
-        total_clients = segment_subset[segment_subset['mois_relatif'] == 0]['clients_initiaux'].sum()
-        
-        if total_clients < 20:  # Filtrer les segments trop petits
-            continue
-        
-        # Moyennes de rétention
-        retention_1m = segment_subset[segment_subset['mois_relatif'] == 1]['taux_retention'].mean()
-        retention_12m = segment_subset[segment_subset['mois_relatif'] == 12]['taux_retention'].mean()
-        retention_18m = segment_subset[segment_subset['mois_relatif'] == 18]['taux_retention'].mean()
-        retention_24m = segment_subset[segment_subset['mois_relatif'] == 24]['taux_retention'].mean()
-        
-        summary_data.append({
-            'segment': str(segment_value),
-            'total_clients': total_clients,
-            'retention_1m': retention_1m if not pd.isna(retention_1m) else 0,
-            'retention_12m': retention_12m if not pd.isna(retention_12m) else 0,
-            'retention_18m': retention_18m if not pd.isna(retention_18m) else 0,
-            'retention_24m': retention_24m if not pd.isna(retention_24m) else 0
-        })
-    
-    return sorted(summary_data, key=lambda x: x['retention_24m'], reverse=True)
+    # Taille totale de chaque segment (clients au mois 0), en filtrant les segments trop petits
+    total_clients = (segment_df[segment_df['mois_relatif'] == 0]
+                     .groupby('segment_value', observed=True, sort=False)['clients_initiaux'].sum())
+    total_clients = total_clients[total_clients >= 20]
+    
+    # Moyennes de rétention des mois clés, en une seule agrégation (0 si le mois n'est pas atteint)
+    key_months = [1, 12, 18, 24]
+    summary = (segment_df.pivot_table(index='segment_value', columns='mois_relatif', values='taux_retention',
+                                      aggfunc='mean', observed=True)
+               .reindex(index=total_clients.index, columns=key_months)
+               .fillna(0))
+    summary.columns = [f'retention_{month}m' for month in key_months]
+    summary.insert(0, 'total_clients', total_clients)
+    summary.insert(0, 'segment', summary.index.astype(str))
+    
+    return summary.sort_values('retention_24m', ascending=False, kind='stable').to_dict('records')
 
 def create_retention_line_chart(chart_data, selected_cohort):
     """Crée le graphique en ligne de rétention"""
@@ -473,175 +440,201 @@ def create_segment_bar_chart(segment_data, segment_type):
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.title = "Dashboard Rétention - Jeune Afrique"
 
-# Charger les données
-retention_global, resume_cohortes, segments_data = load_retention_data()
+# Les données sont chargées à la première utilisation dans chaque processus (et non à l'import),
+# puis conservées : plusieurs workers peuvent démarrer sans bloquer sur le chargement
+@lru_cache(maxsize=1)
+def get_data():
+    """Charge les données de rétention une seule fois par processus"""
+    return load_retention_data()
 
-if retention_global is None:
-    # Page d'erreur si les données ne sont pas disponibles
-    app.layout = dbc.Container([
-        dbc.Alert([
-            html.H4("❌ Données non disponibles", className="alert-heading"),
-            html.P(f"Impossible de charger le fichier {DATA_FILE}"),
-            html.Hr(),
-            html.P("Veuillez d'abord exécuter le script d'analyse de rétention pour générer les données.", className="mb-0")
-        ], color="danger")
-    ], className="mt-5")
-else:
-    # Layout principal
-    app.layout = dbc.Container([
-        # En-tête
-        dbc.Row([
-            dbc.Col([
-                html.H1("📊 Analyse de Rétention des Abonnés", className="text-primary mb-2"),
-                html.P("Tableau de bord interactif - Jeune Afrique", className="text-muted"),
-                html.Hr()
-            ])
-        ], className="mb-4"),
+def build_segment_figure(segment_type, cohort_filter):
+    """Construit le graphique d'évolution d'un segment pour un filtre de cohorte"""
+    segments_data = get_data()[2]
+    evolution_data, main_segments = prepare_segment_evolution_data(segments_data, segment_type, cohort_filter)
+    return create_segment_evolution_chart(evolution_data, main_segments, segment_type)
+
+@lru_cache(maxsize=None)
+def get_segment_figure(segment_type, cohort_filter):
+    """Construit le graphique d'un segment et d'un filtre proposés par les listes une seule fois, puis le réutilise"""
+    return build_segment_figure(segment_type, cohort_filter)
+
+def is_known_segment_choice(segment_type, cohort_filter):
+    """Vrai si le segment et le filtre de cohorte font partie des choix proposés par les listes déroulantes"""
+    return (isinstance(segment_type, str) and segment_type in (get_data()[2] or {})
+            and (cohort_filter == 'all' or (isinstance(cohort_filter, str) and cohort_filter in COHORT_CUTOFFS)))
+
+def serve_layout():
+    """Construit la page du tableau de bord à partir des données chargées"""
+    retention_global, resume_cohortes, segments_data = get_data()
+    
+    if retention_global is None:
+        # Page d'erreur si les données ne sont pas disponibles
+        return dbc.Container([
+            dbc.Alert([
+                html.H4("❌ Données non disponibles", className="alert-heading"),
+                html.P(f"Impossible de charger le fichier {DATA_FILE}"),
+                html.Hr(),
+                html.P("Veuillez d'abord exécuter le script d'analyse de rétention pour générer les données.", className="mb-0")
+            ], color="danger")
+        ], className="mt-5")
+    else:
+        # Layout principal
+        return dbc.Container([
+            # En-tête
+            dbc.Row([
+                dbc.Col([
+                    html.H1("📊 Analyse de Rétention des Abonnés", className="text-primary mb-2"),
+                    html.P("Tableau de bord interactif - Jeune Afrique", className="text-muted"),
+                    html.Hr()
+                ])
+            ], className="mb-4"),
         
-        # Contrôles
-        dbc.Row([
-            dbc.Col([
-                dbc.Card([
-                    dbc.CardBody([
-                        html.H5("🎯 Contrôles", className="card-title"),
-                        dbc.Row([
-                            dbc.Col([
-                                html.Label("Cohorte:", className="fw-bold"),
-                                dcc.Dropdown(
-                                    id='cohort-dropdown',
-                                    options=[{'label': 'Moyenne de toutes les cohortes', 'value': 'all'}] +
-                                           [{'label': f"{row['cohorte']} ({int(row['taille_initiale'])} clients)", 
-                                             'value': row['cohorte']} 
-                                            for _, row in resume_cohortes.iterrows()],
-                                    value='all',
-                                    className="mb-3"
-                                )
-                            ], width=3),
-                            dbc.Col([
-                                html.Label("Segment:", className="fw-bold"),
-                                dcc.Dropdown(
-                                    id='segment-dropdown',
-                                    options=[
-                                        {'label': 'Vue globale', 'value': 'global'},
-                                        {'label': '⏰ Fréquence (monthly/annual/weekly)', 'value': 'Retention_Frequence'},
-                                        {'label': '📍 Source (tm_source)', 'value': 'Retention_Tm_source'},
-                                        {'label': '🔗 Médium (tm_medium)', 'value': 'Retention_Tm_medium'},
-                                        {'label': '💳 Moyen de paiement (PSP)', 'value': 'Retention_Psp'},
-                                        {'label': '💰 Tranches de revenus', 'value': 'Retention_Revenue_tranche'}
-                                    ],
-                                    value='Retention_Frequence',
-                                    className="mb-3"
-                                )
-                            ], width=3),
-                            dbc.Col([
-                                html.Label("Type de vue:", className="fw-bold"),
-                                dcc.Dropdown(
-                                    id='view-type-dropdown',
-                                    options=[
-                                        {'label': '📊 Comparaison (Barres)', 'value': 'comparison'},
-                                        {'label': '📈 Évolution (Courbes)', 'value': 'evolution'}
-                                    ],
-                                    value='comparison',
-                                    className="mb-3"
-                                )
-                            ], width=3),
-                            dbc.Col([
-                                html.Label("Cohortes jusqu'à:", className="fw-bold"),
-                                dcc.Dropdown(
-                                    id='cohort-filter-dropdown',
-                                    options=[
-                                        {'label': '📅 Toutes les cohortes', 'value': 'all'},
-                                        {'label': '🔒 Jusqu\'à 12/2023 (12M+ data)', 'value': '2023-12'},
-                                        {'label': '🔒 Jusqu\'à 06/2023 (18M+ data)', 'value': '2023-06'},
-                                        {'label': '🔒 Jusqu\'à 12/2022 (24M+ data)', 'value': '2022-12'},
-                                        {'label': '🔒 Jusqu\'à 06/2022 (30M+ data)', 'value': '2022-06'}
-                                    ],
-                                    value='2023-06',  # Par défaut, cohortes avec au moins 18M de data
-                                    className="mb-3"
-                                )
-                            ], width=3)
+            # Contrôles
+            dbc.Row([
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            html.H5("🎯 Contrôles", className="card-title"),
+                            dbc.Row([
+                                dbc.Col([
+                                    html.Label("Cohorte:", className="fw-bold"),
+                                    dcc.Dropdown(
+                                        id='cohort-dropdown',
+                                        options=[{'label': 'Moyenne de toutes les cohortes', 'value': 'all'}] +
+                                               [{'label': f"{row['cohorte']} ({int(row['taille_initiale'])} clients)", 
+                                                 'value': row['cohorte']} 
+                                                for _, row in resume_cohortes.iterrows()],
+                                        value='all',
+                                        className="mb-3"
+                                    )
+                                ], width=3),
+                                dbc.Col([
+                                    html.Label("Segment:", className="fw-bold"),
+                                    dcc.Dropdown(
+                                        id='segment-dropdown',
+                                        options=[
+                                            {'label': 'Vue globale', 'value': 'global'},
+                                            {'label': '⏰ Fréquence (monthly/annual/weekly)', 'value': 'Retention_Frequence'},
+                                            {'label': '📍 Source (tm_source)', 'value': 'Retention_Tm_source'},
+                                            {'label': '🔗 Médium (tm_medium)', 'value': 'Retention_Tm_medium'},
+                                            {'label': '💳 Moyen de paiement (PSP)', 'value': 'Retention_Psp'},
+                                            {'label': '💰 Tranches de revenus', 'value': 'Retention_Revenue_tranche'}
+                                        ],
+                                        value='Retention_Frequence',
+                                        className="mb-3"
+                                    )
+                                ], width=3),
+                                dbc.Col([
+                                    html.Label("Type de vue:", className="fw-bold"),
+                                    dcc.Dropdown(
+                                        id='view-type-dropdown',
+                                        options=[
+                                            {'label': '📊 Comparaison (Barres)', 'value': 'comparison'},
+                                            {'label': '📈 Évolution (Courbes)', 'value': 'evolution'}
+                                        ],
+                                        value='comparison',
+                                        className="mb-3"
+                                    )
+                                ], width=3),
+                                dbc.Col([
+                                    html.Label("Cohortes jusqu'à:", className="fw-bold"),
+                                    dcc.Dropdown(
+                                        id='cohort-filter-dropdown',
+                                        options=[
+                                            {'label': '📅 Toutes les cohortes', 'value': 'all'},
+                                            {'label': '🔒 Jusqu\'à 12/2023 (12M+ data)', 'value': '2023-12'},
+                                            {'label': '🔒 Jusqu\'à 06/2023 (18M+ data)', 'value': '2023-06'},
+                                            {'label': '🔒 Jusqu\'à 12/2022 (24M+ data)', 'value': '2022-12'},
+                                            {'label': '🔒 Jusqu\'à 06/2022 (30M+ data)', 'value': '2022-06'}
+                                        ],
+                                        value='2023-06',  # Par défaut, cohortes avec au moins 18M de data
+                                        className="mb-3"
+                                    )
+                                ], width=3)
+                            ])
                         ])
                     ])
                 ])
-            ])
-        ], className="mb-4"),
+            ], className="mb-4"),
         
-        # Métriques clés
-        dbc.Row([
-            dbc.Col([
-                dbc.Card([
-                    dbc.CardBody([
-                        html.H4(f"{len(resume_cohortes)}", className="text-primary"),
-                        html.P("Cohortes analysées", className="mb-0")
+            # Métriques clés
+            dbc.Row([
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            html.H4(f"{len(resume_cohortes)}", className="text-primary"),
+                            html.P("Cohortes analysées", className="mb-0")
+                        ])
                     ])
-                ])
-            ], width=3),
-            dbc.Col([
-                dbc.Card([
-                    dbc.CardBody([
-                        html.H4(f"{resume_cohortes['taille_initiale'].sum():,}", className="text-success"),
-                        html.P("Clients totaux", className="mb-0")
+                ], width=3),
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            html.H4(f"{resume_cohortes['taille_initiale'].sum():,}", className="text-success"),
+                            html.P("Clients totaux", className="mb-0")
+                        ])
                     ])
-                ])
-            ], width=3),
-            dbc.Col([
-                dbc.Card([
-                    dbc.CardBody([
-                        html.H4(f"{resume_cohortes['retention_1m'].mean():.1f}%", className="text-warning"),
-                        html.P("Rétention moy. 1M", className="mb-0")
+                ], width=3),
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            html.H4(f"{resume_cohortes['retention_1m'].mean():.1f}%", className="text-warning"),
+                            html.P("Rétention moy. 1M", className="mb-0")
+                        ])
                     ])
-                ])
-            ], width=3),
-            dbc.Col([
-                dbc.Card([
-                    dbc.CardBody([
-                        html.H4(f"{resume_cohortes['retention_24m'].mean():.1f}%", className="text-danger"),
-                        html.P("Rétention moy. 24M", className="mb-0")
+                ], width=3),
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            html.H4(f"{resume_cohortes['retention_24m'].mean():.1f}%", className="text-danger"),
+                            html.P("Rétention moy. 24M", className="mb-0")
+                        ])
                     ])
-                ])
-            ], width=3)
-        ], className="mb-4"),
+                ], width=3)
+            ], className="mb-4"),
         
-        # Graphiques
-        dbc.Row([
-            dbc.Col([
-                dbc.Card([
-                    dbc.CardBody([
-                        dcc.Graph(id='retention-line-chart')
+            # Graphiques
+            dbc.Row([
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            dcc.Graph(id='retention-line-chart')
+                        ])
                     ])
-                ])
-            ], width=6),
-            dbc.Col([
-                dbc.Card([
-                    dbc.CardBody([
-                        dcc.Graph(id='segment-bar-chart')
+                ], width=6),
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            dcc.Graph(id='segment-bar-chart')
+                        ])
                     ])
-                ])
-            ], width=6)
-        ], className="mb-4"),
+                ], width=6)
+            ], className="mb-4"),
         
-        # Tableau de résumé
-        dbc.Row([
-            dbc.Col([
-                dbc.Card([
-                    dbc.CardHeader(html.H5("📋 Résumé des Cohortes")),
-                    dbc.CardBody([
-                        html.Div(id='summary-table')
+            # Tableau de résumé
+            dbc.Row([
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardHeader(html.H5("📋 Résumé des Cohortes")),
+                        dbc.CardBody([
+                            html.Div(id='summary-table')
+                        ])
                     ])
                 ])
-            ])
-        ], className="mb-4"),
+            ], className="mb-4"),
         
-        # Footer
-        dbc.Row([
-            dbc.Col([
-                html.Hr(),
-                html.P(f"Dashboard généré le {datetime.now().strftime('%d/%m/%Y à %H:%M')} | "
-                      f"Données: {DATA_FILE}", className="text-muted text-center")
+            # Footer
+            dbc.Row([
+                dbc.Col([
+                    html.Hr(),
+                    html.P(f"Dashboard généré le {datetime.now().strftime('%d/%m/%Y à %H:%M')} | "
+                          f"Données: {DATA_FILE}", className="text-muted text-center")
+                ])
             ])
-        ])
         
-    ], fluid=True, className="py-3")
+        ], fluid=True, className="py-3")
+
+app.layout = serve_layout
 
 # Callbacks pour l'interactivité
 @app.callback(
@@ -649,9 +642,28 @@ else:
     Input('cohort-dropdown', 'value')
 )
 def update_retention_chart(selected_cohort):
-    chart_data = prepare_retention_chart_data(retention_global, selected_cohort)
+    # Seules les cohortes proposées par la liste sont mémorisées : une valeur quelconque envoyée par un
+    # client ne doit pas ajouter un graphique de plus au cache du processus
+    if is_known_cohort(selected_cohort):
+        return get_retention_chart(selected_cohort)
+    return build_retention_chart(selected_cohort)
+
+def build_retention_chart(selected_cohort):
+    """Construit le graphique de rétention d'une cohorte"""
+    chart_data = prepare_retention_chart_data(get_data()[0], selected_cohort)
     return create_retention_line_chart(chart_data, selected_cohort)
 
+@lru_cache(maxsize=None)
+def get_retention_chart(selected_cohort):
+    """Construit le graphique de rétention d'une cohorte proposée par la liste une seule fois, puis le réutilise"""
+    return build_retention_chart(selected_cohort)
+
+def is_known_cohort(selected_cohort):
+    """Vrai pour 'all' ou une cohorte proposée par la liste déroulante"""
+    resume_cohortes = get_data()[1]
+    return selected_cohort == 'all' or (isinstance(selected_cohort, str) and resume_cohortes is not None
+                                        and resume_cohortes['cohorte'].eq(selected_cohort).any())
+
 @app.callback(
     Output('segment-bar-chart', 'figure'),
     [Input('segment-dropdown', 'value'),
@@ -659,7 +671,7 @@ def update_retention_chart(selected_cohort):
      Input('cohort-filter-dropdown', 'value')]
 )
 def update_segment_chart(selected_segment, view_type, cohort_filter):
-    print(f"Callback déclenché: segment={selected_segment}, view={view_type}, filter={cohort_filter}")
+    logger.debug(f"Callback déclenché: segment={selected_segment}, view={view_type}, filter={cohort_filter}")
     
     if selected_segment == 'global':
         # Graphique vide avec message
@@ -676,16 +688,20 @@ def update_segment_chart(selected_segment, view_type, cohort_filter):
             height=400
         )
         return fig
-    else:
+    elif is_known_segment_choice(selected_segment, cohort_filter):
         # Toujours afficher les courbes d'évolution avec le filtre
-        evolution_data, main_segments = prepare_segment_evolution_data(segments_data, selected_segment, cohort_filter)
-        return create_segment_evolution_chart(evolution_data, main_segments, selected_segment)
+        return get_segment_figure(selected_segment, cohort_filter)
+    else:
+        # Valeurs hors des listes déroulantes : graphique construit sans être mémorisé
+        return build_segment_figure(selected_segment, cohort_filter)
 
 @app.callback(
     Output('summary-table', 'children'),
     Input('cohort-dropdown', 'value')
 )
 def update_summary_table(selected_cohort):
+    resume_cohortes = get_data()[1]
+    
     # Créer un tableau HTML des principales métriques
     if selected_cohort == 'all':
         # Afficher toutes les cohortes
@@ -730,6 +746,7 @@ def update_summary_table(selected_cohort):
     return dbc.Table(table_header + table_body, striped=True, bordered=True, hover=True, size="sm")
 
 if __name__ == '__main__':
+    retention_global, resume_cohortes, segments_data = get_data()
     if retention_global is not None:
         print("\n🚀 DASHBOARD DE RÉTENTION LANCÉ")
         print("=" * 50)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Préparation commune des données d'abonnements, partagée par recherche_upgrade.py et gemini/rapport_final.py.
+
+Charge les transactions et les coupons, les fusionne, supprime les doublons exacts et crée 'nom_offre'.
+Le résultat est mis en cache au format Parquet et relu tant que les fichiers sources ne changent pas.
+"""
+import pandas as pd
+
+from gemini.cache_donnees import merged_cache_path, read_cached_frame, write_cached_frame
+
+# --- CONFIGURATION ---
+TRANSACTIONS_FILE = 'transaction.csv'
+COUPONS_FILE = 'Table des coupons-1.xlsx - Coupons.csv'
+# Seules les colonnes utilisées par rapport_final.py ou recherche_upgrade.py sont lues
+TRANSACTIONS_COLUMNS = [
+    'customer_id', 'subscription_id', 'order_date', 'ECHEANCE_date',
+    'order_date (Année)', 'order_date (Mois)', 'order_date (Jour du mois)', 'ECHEANCE_annee', 'ECHEANCE_mois', 'ECHEANCE_jour',
+    'frequence', 'payment_origin', 'psp', 'discount', 'tm_source', 'tm_medium', 'tm_campaign', 'consolidated_revenues_ht_euro'
+]
+# Dates lues comme texte (conversion unique par pd.to_datetime dans chaque analyse), le reste est inféré par pyarrow
+TRANSACTIONS_DTYPES = {'order_date': str, 'ECHEANCE_date': str}
+
+def prepare(transactions_path=TRANSACTIONS_FILE, coupons_path=COUPONS_FILE):
+    """Retourne les transactions fusionnées avec les coupons, dédoublonnées et enrichies de 'nom_offre'."""
+    # Cache propre à la version des deux fichiers sources et de ce module
+    cache_path = merged_cache_path('merged_transactions', __file__, transactions_path, coupons_path)
+    df_cache = read_cached_frame(cache_path)
+    if df_cache is not None:
+        return df_cache
+
+    # Montants au format français (virgule décimale) convertis directement par le lecteur CSV
+    df_trans = pd.read_csv(
+        transactions_path, encoding='latin1', engine='pyarrow',
+        usecols=TRANSACTIONS_COLUMNS, dtype=TRANSACTIONS_DTYPES, decimal=','
+    )
+    # Seule la clé de jointure de la table des coupons est utilisée
+    df_coupons = pd.read_csv(coupons_path, encoding='latin1', engine='pyarrow', usecols=['Coupon Id'])
+    df_merged = pd.merge(df_trans, df_coupons, left_on='discount', right_on='Coupon Id', how='left')
+    # Doublons exacts repérés sur une empreinte (hash) par ligne : une seule colonne uint64 à comparer
+    empreintes = pd.util.hash_pandas_object(df_merged, index=False)
+    df_cleaned = df_merged[~empreintes.duplicated()].reset_index(drop=True)
+
+    # Campagne, à défaut coupon, à défaut offre standard (remplissages vectorisés, sans tableau objet intermédiaire)
+    df_cleaned['nom_offre'] = df_cleaned['tm_campaign'].fillna(df_cleaned['discount']).fillna('Offre Standard')
+    write_cached_frame(df_cleaned, cache_path)
+    return df_cleaned
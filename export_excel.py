@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+Écriture d'onglets Excel en flux (xlsxwriter, mode constant_memory),
+partagée par Claude_retention_analysis.py et gemini/rapport_final.py.
+"""
+
+def write_excel_sheet(workbook, sheet_name, df):
+    """Écrit un DataFrame ligne par ligne (ordre requis par le mode constant_memory)"""
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({'bold': True})
+    # En-têtes écrits en texte, quel que soit le type des noms de colonnes (segments, mois...)
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+
+    values = df.astype(object).where(df.notna(), None)
+    for row_num, row in enumerate(values.itertuples(index=False), start=1):
+        worksheet.write_row(row_num, 0, row)
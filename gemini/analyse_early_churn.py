@@ -3,16 +3,23 @@
 Pipeline complet et final de traitement et d'analyse des données d'abonnements.
 Version définitive avec imputation des dates d'échéance manquantes pour les abonnements mensuels.
 """
+import argparse
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
 from matplotlib.ticker import PercentFormatter
+from cache_donnees import merged_cache_path, read_cached_frame, write_cached_frame
 
 # --- CONFIGURATION ---
 TRANSACTIONS_FILE = 'transaction.csv'
 COUPONS_FILE = 'Table des coupons-1.xlsx - Coupons.csv'
-OUTPUT_FILE = 'rapport_mensuel_detaille.csv'
+OUTPUT_FILE = 'rapport_mensuel_detaille.parquet'
+# Copie CSV optionnelle pour une lecture humaine (None : seul le Parquet, bien plus rapide à écrire, est produit)
+OUTPUT_CSV_FILE = None
+# Caractéristiques comparées entre churners et retenus (stockées en catégories après l'agrégation)
+CARACTERISTIQUES_A_ANALYSER = ['nom_offre', 'frequence', 'payment_origin', 'psp', 'tm_source']
+# Dates lues comme texte (conversion unique par pd.to_datetime plus loin), le reste est inféré par pyarrow
+TRANSACTIONS_DTYPES = {'order_date': str, 'ECHEANCE_date': str, 'order_paid_date_processed': str}
 
 # --- Définition des fonctions ---
 
@@ -20,13 +27,21 @@ def load_and_merge_data(transactions_path, coupons_path):
     """Charge, fusionne, nettoie et enrichit les données initiales."""
     print("--- Étape 1: Chargement et fusion ---")
     try:
-        df_trans = pd.read_csv(transactions_path, encoding='latin1')
-        df_coupons = pd.read_csv(coupons_path, encoding='latin1')
+        cache_path = merged_cache_path('merged_analyse_early_churn', __file__, transactions_path, coupons_path)
+        df_cache = read_cached_frame(cache_path)
+        if df_cache is not None:
+            return df_cache
+
+        df_trans = pd.read_csv(transactions_path, encoding='latin1', engine='pyarrow', dtype=TRANSACTIONS_DTYPES)
+        df_coupons = pd.read_csv(coupons_path, encoding='latin1', engine='pyarrow')
         df_merged = pd.merge(df_trans, df_coupons, left_on='discount', right_on='Coupon Id', how='left')
-        df_cleaned = df_merged.drop_duplicates().reset_index(drop=True)
+        # Doublons exacts repérés sur une empreinte (hash) par ligne : une seule colonne uint64 à comparer
+        empreintes = pd.util.hash_pandas_object(df_merged, index=False)
+        df_cleaned = df_merged[~empreintes.duplicated()].reset_index(drop=True)
         
-        df_cleaned['nom_offre'] = np.where(pd.notna(df_cleaned['tm_campaign']), df_cleaned['tm_campaign'], df_cleaned['discount'])
-        df_cleaned['nom_offre'] = df_cleaned['nom_offre'].fillna('Offre Standard')
+        # Campagne, à défaut coupon, à défaut offre standard (remplissages vectorisés, sans tableau objet intermédiaire)
+        df_cleaned['nom_offre'] = df_cleaned['tm_campaign'].fillna(df_cleaned['discount']).fillna('Offre Standard')
+        write_cached_frame(df_cleaned, cache_path)
         return df_cleaned
     except Exception as e:
         print(f"ERREUR CRITIQUE lors du chargement : {e}")
@@ -37,9 +52,11 @@ def group_and_impute_data(df):
     if df is None: return None
     print("\n--- Étape 2: Agrégation et imputation des dates ---")
     
-    agg_logic = {col: 'first' for col in df.columns if col != 'subscription_id'}
-    agg_logic['ECHEANCE_date'] = 'last'
-    df_grouped = df.groupby('subscription_id').agg(agg_logic).reset_index()
+    # 'first' (première valeur non nulle) calculé en un seul appel pour toutes les colonnes, 'last' pour l'échéance
+    groupes = df.groupby('subscription_id')
+    df_grouped = groupes.first()
+    df_grouped['ECHEANCE_date'] = groupes['ECHEANCE_date'].last()
+    df_grouped = df_grouped.reset_index()
     
     # Conversion des colonnes de date, les erreurs deviennent NaT (Not a Time)
     df_grouped['order_date'] = pd.to_datetime(df_grouped['order_date'], errors='coerce')
@@ -57,6 +74,9 @@ def group_and_impute_data(df):
     df_grouped.loc[condition_to_fix, 'ECHEANCE_date'] = df_grouped.loc[condition_to_fix, 'order_date'] + pd.Timedelta(days=30)
     
     print(f"-> {condition_to_fix.sum()} dates d'échéance manquantes ont été 'forgées' pour les abonnements mensuels.")
+    # Colonnes analysées en catégories : value_counts et drop_duplicates travaillent alors sur des codes entiers
+    for col in CARACTERISTIQUES_A_ANALYSER:
+        df_grouped[col] = df_grouped[col].astype('category')
     return df_grouped
 
 
@@ -67,90 +87,143 @@ def create_monthly_report(df_sub):
     
     df_sorted = df_sub.sort_values(by=['customer_id', 'order_date']).copy()
     
-    df_sorted['echeance_precedente'] = df_sorted.groupby('customer_id')['ECHEANCE_date'].shift(1)
-    df_sorted['duree_trou_jours'] = (df_sorted['order_date'] - df_sorted['echeance_precedente']).dt.days
+    # Échéance précédente du même client : décalage d'une ligne sur les données triées, remis à NaT
+    # à chaque changement de client (équivaut à groupby('customer_id').shift(1), sans construire les groupes)
+    customer_ids = df_sorted['customer_id'].to_numpy()
+    nouveau_client = np.ones(len(df_sorted), dtype=bool)
+    nouveau_client[1:] = customer_ids[1:] != customer_ids[:-1]
+    echeance_precedente = np.roll(df_sorted['ECHEANCE_date'].to_numpy(), 1)
+    echeance_precedente[nouveau_client] = np.datetime64('NaT')
+    df_sorted['echeance_precedente'] = echeance_precedente
+    # Écart en jours entiers calculé directement sur les tableaux NumPy (arrondi à l'inférieur comme .dt.days)
+    ecart_jours = (df_sorted['order_date'].to_numpy() - echeance_precedente).astype('timedelta64[D]')
+    df_sorted['duree_trou_jours'] = np.where(np.isnat(ecart_jours), np.nan, ecart_jours.astype('int64'))
     
-    seuil_churn_jours = np.where(df_sorted['frequence'].str.lower().str.contains('monthly', na=False), 35, 90)
+    # Fréquence mise en minuscules et testée une seule fois, réutilisée pour le délai de grâce et le Montant
+    frequences = df_sorted['frequence'].astype(str).str.lower()
+    is_monthly = frequences.str.contains('monthly', na=False).to_numpy()
+    is_annual = frequences.str.contains('annual', na=False).to_numpy()
+    seuil_churn_jours = np.where(is_monthly, 35, 90)
     df_sorted['nouveau_parcours'] = np.where((df_sorted['duree_trou_jours'].isna()) | (df_sorted['duree_trou_jours'] >= seuil_churn_jours), True, False)
     
-    df_sorted['id_parcours'] = df_sorted['customer_id'].astype(str) + '_' + df_sorted['nouveau_parcours'].cumsum().astype(str)
-    df_sorted['journey_start_date'] = df_sorted.groupby('id_parcours')['order_date'].transform('min')
+    # Identifiant entier : le compteur cumulé des débuts de parcours est unique par parcours, puisque
+    # la première ligne de chaque client ouvre toujours un nouveau parcours
+    df_sorted['id_parcours'] = df_sorted['nouveau_parcours'].cumsum().astype('int64')
+    # Début et dernier mois couvert de chaque parcours en une seule agrégation, au niveau abonnement
+    order_months = df_sorted['order_date'].to_numpy().astype('datetime64[M]')
+    end_months = df_sorted['ECHEANCE_date'].to_numpy().astype('datetime64[M]')
+    stats_parcours = pd.DataFrame({
+        'order_date': df_sorted['order_date'],
+        'fin_couverte': np.where(end_months >= order_months, end_months, np.datetime64('NaT'))
+    }).groupby(df_sorted['id_parcours'], sort=False).agg(
+        journey_start_date=('order_date', 'min'), fin_parcours=('fin_couverte', 'max')
+    )
+    df_sorted = df_sorted.join(stats_parcours['journey_start_date'], on='id_parcours')
     
-    all_months_data = []
-    for row in df_sorted.itertuples(index=False):
-        if pd.isna(row.order_date) or pd.isna(row.ECHEANCE_date): continue
-        start_month = row.order_date.to_period('M').to_timestamp()
-        end_month = row.ECHEANCE_date.to_period('M').to_timestamp()
-        date_range = pd.date_range(start=start_month, end=end_month, freq='MS')
-
-        for month_date in date_range:
-            month_relatif = (month_date.year - row.journey_start_date.year) * 12 + (month_date.month - row.journey_start_date.month)
-            montant_mensuel = 0
-            try:
-                revenue = float(str(getattr(row, 'consolidated_revenues_ht_euro', '0')).replace(',', '.'))
-                frequence = str(getattr(row, 'frequence', '')).lower()
-                if 'annual' in frequence: montant_mensuel = revenue / 12
-                elif 'monthly' in frequence: montant_mensuel = revenue
-            except (ValueError, TypeError): pass
-            
-            new_row = {col: getattr(row, col) for col in row._fields}
-            new_row.update({'month': month_date, 'month_relatif': month_relatif, 'Montant': montant_mensuel})
-            all_months_data.append(new_row)
-            
-    return pd.DataFrame(all_months_data)
-
-def analyze_churn_characteristics(df):
+    # Expansion vectorisée : chaque abonnement est répété une fois par mois couvert
+    dates_valides = (df_sorted['order_date'].notna() & df_sorted['ECHEANCE_date'].notna()).to_numpy()
+    df_sorted = df_sorted[dates_valides]
+    is_monthly, is_annual = is_monthly[dates_valides], is_annual[dates_valides]
+    start_months, end_months = order_months[dates_valides], end_months[dates_valides]
+    journey_start_months = df_sorted['journey_start_date'].to_numpy().astype('datetime64[M]')
+    n_months = np.maximum((end_months - start_months).astype('int64') + 1, 0)
+    row_idx = np.repeat(np.arange(len(df_sorted)), n_months)
+    month_offsets = np.arange(n_months.sum()) - np.repeat(np.cumsum(n_months) - n_months, n_months)
+    months = start_months[row_idx] + month_offsets
+
+    # Revenus convertis en une passe : un revenu absent reste NaN, un revenu illisible vaut 0
+    revenues_bruts = df_sorted['consolidated_revenues_ht_euro']
+    revenues = pd.to_numeric(revenues_bruts.astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    revenues = revenues.mask(revenues.isna() & revenues_bruts.notna(), 0).to_numpy()
+    montants = np.where(is_annual, revenues / 12, np.where(is_monthly, revenues, 0))
+
+    # Tableau final assemblé en une fois à partir des tableaux NumPy, sans enregistrement intermédiaire
+    final_df = df_sorted.iloc[row_idx].reset_index(drop=True).assign(
+        month=months.astype('datetime64[ns]'),
+        month_relatif=(months - journey_start_months[row_idx]).astype('int64'),
+        Montant=montants[row_idx]
+    )
+
+    # Durée du parcours (dernier mois relatif couvert), rattachée aux lignes mensuelles par id_parcours
+    ecart_mois = (stats_parcours['fin_parcours'].to_numpy().astype('datetime64[M]')
+                  - stats_parcours['journey_start_date'].to_numpy().astype('datetime64[M]'))
+    duree_parcours = pd.Series(ecart_mois.astype('int64'), index=stats_parcours.index)[~np.isnat(ecart_mois)]
+    final_df = final_df.join(duree_parcours.rename('duree_parcours'), on='id_parcours')
+    return final_df
+
+def plot_churn_distributions(distributions):
+    """Affiche dans une seule figure les 5 principales valeurs de chaque caractéristique, churners vs retenus."""
+    fig, axes = plt.subplots(len(distributions), 1, figsize=(12, 6 * len(distributions)), squeeze=False)
+    for ax, (char, df_dist) in zip(axes[:, 0], distributions.items()):
+        df_top = df_dist.head(5)
+        positions = np.arange(len(df_top))
+        ax.bar(positions - 0.2, df_top['Churners (%)'], width=0.4, color='salmon', label='Churners (%)')
+        ax.bar(positions + 0.2, df_top['Retenus (%)'], width=0.4, color='lightblue', label='Retenus (%)')
+        ax.set_xticks(positions)
+        ax.set_xticklabels(df_top.index, rotation=45, ha='right')
+        ax.set_title(f"Distribution de '{char}' pour les Churners vs Retenus", fontsize=16)
+        ax.set_ylabel("Pourcentage de clients (%)", fontsize=12)
+        ax.set_xlabel(char, fontsize=12)
+        ax.legend(title='Groupe')
+    fig.tight_layout()
+    plt.show()
+
+def analyze_churn_characteristics(df, afficher_graphiques=False):
     """Identifie les clients churnés tôt et analyse leurs caractéristiques."""
     if df is None or df.empty: return
     print("\n--- Étape 4: Analyse des caractéristiques du Churn ---")
     
-    df['duree_parcours'] = df.groupby('id_parcours')['month_relatif'].transform('max')
-    
-    df_churners = df[df['duree_parcours'] <= 2].copy()
-    df_retained = df[df['duree_parcours'] > 2].copy()
+    # duree_parcours est calculée par create_monthly_report
+    # Masques calculés une seule fois et combinés, sans copier les sous-ensembles du tableau mensuel
+    # (une durée manquante ne classe la ligne dans aucun des deux groupes)
+    duree_parcours = df['duree_parcours'].to_numpy()
+    est_churner = duree_parcours <= 2
+    est_retenu = duree_parcours > 2
+    est_initial = df['month_relatif'].to_numpy() == 0
     
-    print(f"-> {df_churners['customer_id'].nunique()} clients ont churné dans les 3 premiers mois.")
-    print(f"-> {df_retained['customer_id'].nunique()} clients sont restés au-delà de 3 mois.")
+    print(f"-> {df.loc[est_churner, 'customer_id'].nunique()} clients ont churné dans les 3 premiers mois.")
+    print(f"-> {df.loc[est_retenu, 'customer_id'].nunique()} clients sont restés au-delà de 3 mois.")
 
-    churners_initial = df_churners[df_churners['month_relatif'] == 0].drop_duplicates(subset=['id_parcours'])
-    retained_initial = df_retained[df_retained['month_relatif'] == 0].drop_duplicates(subset=['id_parcours'])
-
-    caracteristiques_a_analyser = ['nom_offre', 'frequence', 'payment_origin', 'psp', 'tm_source']
+    # Seules les colonnes comparées sont extraites : la boucle ci-dessous ne lit rien d'autre
+    colonnes_profil = ['id_parcours'] + CARACTERISTIQUES_A_ANALYSER
+    churners_initial = df.loc[est_churner & est_initial, colonnes_profil].drop_duplicates(subset=['id_parcours'])
+    retained_initial = df.loc[est_retenu & est_initial, colonnes_profil].drop_duplicates(subset=['id_parcours'])
     
-    for char in caracteristiques_a_analyser:
+    distributions = {}
+    for char in CARACTERISTIQUES_A_ANALYSER:
         print(f"\n--- Comparaison pour : {char} ---")
         churn_dist = churners_initial[char].value_counts(normalize=True).mul(100).rename('Churners (%)')
         retained_dist = retained_initial[char].value_counts(normalize=True).mul(100).rename('Retenus (%)')
         
         df_dist = pd.concat([churn_dist, retained_dist], axis=1).fillna(0).sort_values(by='Churners (%)', ascending=False)
+        # Catégories absentes des deux groupes (comptées à 0) écartées, libellés repassés en texte pour l'affichage
+        df_dist = df_dist[df_dist.any(axis=1)]
+        df_dist.index = df_dist.index.astype(str)
         print(df_dist.head(10).round(2))
-        
-        df_plot_data = df_dist.head(5).reset_index().rename(columns={'index': char})
-        df_plot = pd.melt(df_plot_data, id_vars=char, var_name='Groupe', value_name='Pourcentage')
-        
-        plt.figure(figsize=(12, 6))
-        sns.barplot(data=df_plot, x=char, y='Pourcentage', hue='Groupe', palette=['salmon', 'lightblue'])
-        plt.title(f"Distribution de '{char}' pour les Churners vs Retenus", fontsize=16)
-        plt.ylabel("Pourcentage de clients (%)", fontsize=12)
-        plt.xlabel(char, fontsize=12)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        plt.show()
-
-def main():
+        distributions[char] = df_dist
+
+    # Graphiques optionnels (--plot) : une seule figure et un seul affichage pour toutes les caractéristiques
+    if afficher_graphiques:
+        plot_churn_distributions(distributions)
+
+def main(afficher_graphiques=False):
     """Fonction principale qui orchestre l'ensemble du pipeline."""
     df_initial = load_and_merge_data(TRANSACTIONS_FILE, COUPONS_FILE)
     df_aggregated = group_and_impute_data(df_initial)
     df_monthly_report = create_monthly_report(df_aggregated)
     
     if df_monthly_report is not None:
-        analyze_churn_characteristics(df_monthly_report)
+        analyze_churn_characteristics(df_monthly_report, afficher_graphiques)
         print(f"\n--- Sauvegarde du rapport final ---")
         try:
-            df_monthly_report.to_csv(OUTPUT_FILE, index=False, encoding='utf-8-sig')
+            df_monthly_report.to_parquet(OUTPUT_FILE, index=False, compression='zstd')
+            if OUTPUT_CSV_FILE:
+                df_monthly_report.to_csv(OUTPUT_CSV_FILE, index=False, encoding='utf-8-sig')
             print(f"-> Pipeline terminé. Fichier de sortie : '{OUTPUT_FILE}'")
         except Exception as e:
             print(f"ERREUR CRITIQUE lors de la sauvegarde : {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Pipeline de traitement et d'analyse des abonnements.")
+    parser.add_argument('--plot', action='store_true', help="affiche les graphiques de comparaison churners / retenus")
+    main(afficher_graphiques=parser.parse_args().plot)
\ No newline at end of file
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Cache Parquet des données fusionnées (transactions + coupons), partagé par les scripts d'analyse.
+
+Le cache n'est jamais bloquant : un fichier illisible est ignoré et une écriture impossible
+est simplement signalée, les données étant alors rechargées depuis les CSV.
+"""
+import hashlib
+import os
+import pandas as pd
+
+# Données fusionnées mises en cache ici, relues tant que ni les sources ni le script ne changent
+CACHE_DIR = '.cache'
+
+def merged_cache_path(prefixe, *sources):
+    """Chemin du cache Parquet, propre au préfixe et à la version (date de modification) de chaque source."""
+    cle = '|'.join(f"{os.path.abspath(chemin)}:{os.path.getmtime(chemin)}" for chemin in sources)
+    return os.path.join(CACHE_DIR, f"{prefixe}_{hashlib.md5(cle.encode()).hexdigest()}.parquet")
+
+def read_cached_frame(cache_path):
+    """Relit le cache s'il existe, None s'il est absent ou illisible (les données sont alors recalculées)."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        df = pd.read_parquet(cache_path)
+    except Exception as e:
+        print(f"⚠️ Cache illisible ignoré '{cache_path}' : {e}")
+        return None
+    print(f"-> Données fusionnées relues depuis le cache '{cache_path}'.")
+    return df
+
+def write_cached_frame(df, cache_path):
+    """Écrit le cache dans un fichier temporaire puis le renomme, pour ne jamais laisser un cache partiel."""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(f'{cache_path}.tmp', index=False)
+        os.replace(f'{cache_path}.tmp', cache_path)
+    except Exception as e:
+        print(f"⚠️ Cache non écrit '{cache_path}' : {e}")
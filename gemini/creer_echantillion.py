@@ -7,22 +7,27 @@ FICHIER_SORTIE = 'transaction_sample_by_customer.csv'
 FRACTION_ECHANTILLON = 0.20 
 ENCODAGE_SOURCE = 'latin1'
 ENCODAGE_CIBLE = 'utf-8-sig'
+# Nombre de lignes lues à la fois lors du filtrage : la mémoire utilisée ne dépend plus de la taille du fichier
+TAILLE_BLOC = 500_000
 
-def sample_by_customer_id(source_path, output_path, fraction, source_encoding, target_encoding):
+def sample_by_customer_id(source_path, output_path, fraction, source_encoding, target_encoding, chunk_size=TAILLE_BLOC):
     """
-    Charge un fichier CSV, extrait un échantillon aléatoire de customer_id
-    et sauvegarde toutes les lignes de ces clients dans un nouveau fichier.
+    Lit les customer_id d'un fichier CSV, en extrait un échantillon aléatoire
+    et recopie, bloc par bloc, toutes les lignes de ces clients dans un nouveau fichier.
     """
     print(f"--- Démarrage de l'échantillonnage par customer_id pour le fichier : {source_path} ---")
 
     try:
-        # Étape 1: Chargement du fichier source
-        print(f"1. Chargement du fichier source avec l'encodage '{source_encoding}'...")
-        df = pd.read_csv(source_path, encoding=source_encoding)
-        print(f"-> Fichier chargé. Nombre total de lignes : {len(df)}")
+        # Étape 1: Chargement de la seule colonne customer_id (lecteur pyarrow, multi-thread)
+        print(f"1. Chargement des customer_id du fichier source avec l'encodage '{source_encoding}'...")
+        # Identifiants lus comme texte, pour être comparés tels quels aux blocs lus à l'étape 4
+        customer_ids = pd.read_csv(
+            source_path, encoding=source_encoding, engine='pyarrow', usecols=['customer_id'], dtype={'customer_id': str}
+        )['customer_id']
+        print(f"-> Fichier chargé. Nombre total de lignes : {len(customer_ids)}")
 
         # Étape 2: Lister les clients uniques
-        unique_customers = df['customer_id'].unique()
+        unique_customers = customer_ids.unique()
         n_unique_customers = len(unique_customers)
         print(f"-> {n_unique_customers} clients uniques trouvés.")
 
@@ -37,14 +42,18 @@ def sample_by_customer_id(source_path, output_path, fraction, source_encoding, t
         )
         print("-> Clients tirés au sort avec succès.")
 
-        # Étape 4: Filtrer le DataFrame original pour ne garder que les lignes des clients sélectionnés
-        print("4. Création du DataFrame échantillonné...")
-        df_sampled = df[df['customer_id'].isin(sampled_customer_ids)]
-        print(f"-> Le nouvel échantillon contient {len(df_sampled)} lignes pour {len(sampled_customer_ids)} clients.")
-
-        # Étape 5: Sauvegarde du nouvel échantillon en UTF-8
-        print(f"5. Sauvegarde de l'échantillon dans '{output_path}' avec l'encodage '{target_encoding}'...")
-        df_sampled.to_csv(output_path, index=False, encoding=target_encoding)
+        # Étapes 4 et 5: Filtrer le fichier source bloc par bloc et écrire au fur et à mesure les lignes
+        # des clients sélectionnés (valeurs recopiées telles quelles, ré-encodées dans l'encodage cible)
+        print(f"4. Filtrage par blocs de {chunk_size} lignes et sauvegarde dans '{output_path}' avec l'encodage '{target_encoding}'...")
+        sampled_customer_ids = set(sampled_customer_ids)
+        n_sampled_rows = 0
+        with open(output_path, 'w', encoding=target_encoding, newline='') as output_file:
+            chunks = pd.read_csv(source_path, encoding=source_encoding, dtype=str, keep_default_na=False, chunksize=chunk_size)
+            for i, chunk in enumerate(chunks):
+                chunk_sampled = chunk[chunk['customer_id'].isin(sampled_customer_ids)]
+                chunk_sampled.to_csv(output_file, index=False, header=(i == 0))
+                n_sampled_rows += len(chunk_sampled)
+        print(f"-> Le nouvel échantillon contient {n_sampled_rows} lignes pour {len(sampled_customer_ids)} clients.")
         
         print("\n--- Opération terminée avec succès ! ---")
         print(f"Le fichier '{output_path}' a été créé.")
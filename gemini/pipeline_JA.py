@@ -9,16 +9,28 @@ Ce script réalise les opérations suivantes :
 4. Identifie les "parcours" clients en liant les réabonnements (écarts < 90 jours).
 5. "Explose" chaque parcours en lignes mensuelles détaillées.
 6. Calcule des métriques clés comme le revenu mensuel ('Montant') et le mois relatif.
-7. Sauvegarde le résultat dans un fichier CSV.
+7. Sauvegarde le résultat dans un fichier Parquet (et en option dans un fichier CSV).
 """
 import pandas as pd
 import numpy as np
+from cache_donnees import merged_cache_path, read_cached_frame, write_cached_frame
 
 # --- CONFIGURATION ---
 # Modifiez ces chemins si vos fichiers sont dans un autre dossier.
 TRANSACTIONS_FILE = 'transaction.csv'
 COUPONS_FILE = 'Table des coupons-1.xlsx - Coupons.csv'
-OUTPUT_FILE = 'rapport_mensuel_detaille.csv'
+OUTPUT_FILE = 'rapport_mensuel_detaille.parquet'
+# Copie CSV optionnelle pour une lecture humaine (None : seul le Parquet, bien plus rapide à écrire, est produit)
+OUTPUT_CSV_FILE = None
+
+# Seules les colonnes reprises dans le rapport final sont lues ; les dates restent du texte
+# (converties une seule fois dans create_monthly_report), le reste est inféré par pyarrow.
+TRANSACTIONS_COLUMNS = [
+    'customer_id', 'subscription_id', 'order_date', 'ECHEANCE_date', 'frequence', 'payment_origin', 'psp',
+    'order_paid_date_processed', 'discount', 'custom_discount', 'tm_source', 'tm_medium', 'tm_campaign',
+    'consolidated_revenues_ht_euro'
+]
+TRANSACTIONS_DTYPES = {'order_date': str, 'ECHEANCE_date': str, 'order_paid_date_processed': str}
 
 
 def load_and_merge_data(transactions_path, coupons_path):
@@ -27,16 +39,28 @@ def load_and_merge_data(transactions_path, coupons_path):
     """
     print("--- Étape 1: Chargement et fusion des données sources ---")
     try:
-        df_trans = pd.read_csv(transactions_path, encoding='latin1')
-        df_coupons = pd.read_csv(coupons_path, encoding='latin1')
+        cache_path = merged_cache_path('merged_pipeline_JA', __file__, transactions_path, coupons_path)
+        df_cache = read_cached_frame(cache_path)
+        if df_cache is not None:
+            return df_cache
+
+        df_trans = pd.read_csv(
+            transactions_path, encoding='latin1', engine='pyarrow',
+            usecols=TRANSACTIONS_COLUMNS, dtype=TRANSACTIONS_DTYPES
+        )
+        # Seule la clé de jointure de la table des coupons est utilisée
+        df_coupons = pd.read_csv(coupons_path, encoding='latin1', engine='pyarrow', usecols=['Coupon Id'])
 
         # Fusion en utilisant le nom de colonne corrigé 'Coupon Id'
         # Utilise une jointure à gauche pour conserver toutes les transactions.
         df_merged = pd.merge(df_trans, df_coupons, left_on='discount', right_on='Coupon Id', how='left')
         
-        # Suppression des doublons exacts
-        df_cleaned = df_merged.drop_duplicates().reset_index(drop=True)
+        # Suppression des doublons exacts, repérés sur une empreinte (hash) par ligne :
+        # une seule colonne uint64 à comparer au lieu de toutes les colonnes texte
+        empreintes = pd.util.hash_pandas_object(df_merged, index=False)
+        df_cleaned = df_merged[~empreintes.duplicated()].reset_index(drop=True)
         print(f"-> Fichiers chargés et fusionnés. Résultat : {df_cleaned.shape[0]} lignes.")
+        write_cached_frame(df_cleaned, cache_path)
         return df_cleaned
 
     except FileNotFoundError as e:
@@ -57,16 +81,12 @@ def group_by_subscription(df):
     
     print("\n--- Étape 2: Agrégation par subscription_id ---")
     
-    # Définition d'une logique d'agrégation intelligente
-    # 'first' pour les données stables, 'last' pour les dates de fin,
-    # et concaténation pour les données qui peuvent varier.
-    agg_logic = {col: 'first' for col in df.columns}
-    agg_logic['ECHEANCE_date'] = 'last'
-    
-    # On retire la clé de groupe de la logique d'agrégation
-    agg_logic.pop('subscription_id', None)
-
-    df_grouped = df.groupby('subscription_id').agg(agg_logic).reset_index()
+    # Logique d'agrégation : 'first' (première valeur non nulle) pour les données stables,
+    # calculé en un seul appel pour toutes les colonnes, et 'last' pour la date de fin.
+    groupes = df.groupby('subscription_id')
+    df_grouped = groupes.first()
+    df_grouped['ECHEANCE_date'] = groupes['ECHEANCE_date'].last()
+    df_grouped = df_grouped.reset_index()
     print(f"-> Agrégation terminée. Résultat : {df_grouped.shape[0]} lignes.")
     return df_grouped
 
@@ -85,56 +105,72 @@ def create_monthly_report(df_sub):
     df_sub['ECHEANCE_date'] = pd.to_datetime(df_sub['ECHEANCE_date'], errors='coerce')
     df_sorted = df_sub.sort_values(by=['customer_id', 'order_date']).copy()
 
-    df_sorted['echeance_precedente'] = df_sorted.groupby('customer_id')['ECHEANCE_date'].shift(1)
-    df_sorted['duree_trou_jours'] = (df_sorted['order_date'] - df_sorted['echeance_precedente']).dt.days
+    # Échéance précédente du même client : décalage d'une ligne sur les données triées, remis à NaT
+    # à chaque changement de client (équivaut à groupby('customer_id').shift(1), sans construire les groupes)
+    customer_ids = df_sorted['customer_id'].to_numpy()
+    nouveau_client = np.ones(len(df_sorted), dtype=bool)
+    nouveau_client[1:] = customer_ids[1:] != customer_ids[:-1]
+    echeance_precedente = np.roll(df_sorted['ECHEANCE_date'].to_numpy(), 1)
+    echeance_precedente[nouveau_client] = np.datetime64('NaT')
+    df_sorted['echeance_precedente'] = echeance_precedente
+    # Écart en jours entiers calculé directement sur les tableaux NumPy (arrondi à l'inférieur comme .dt.days)
+    ecart_jours = (df_sorted['order_date'].to_numpy() - echeance_precedente).astype('timedelta64[D]')
+    df_sorted['duree_trou_jours'] = np.where(np.isnat(ecart_jours), np.nan, ecart_jours.astype('int64'))
     df_sorted['nouveau_parcours'] = np.where(
         (df_sorted['duree_trou_jours'].isna()) | (df_sorted['duree_trou_jours'] >= 90), True, False
     )
-    df_sorted['parcours_numero'] = df_sorted.groupby('customer_id')['nouveau_parcours'].cumsum()
+    # Numéro de parcours par client : compteur cumulé global, diminué du total atteint avant la première ligne
+    # de chaque client (mêmes frontières nouveau_client, sans construire les groupes) ; un client manquant
+    # reste sans numéro, comme avec groupby('customer_id').cumsum()
+    nouveaux_parcours = df_sorted['nouveau_parcours'].to_numpy()
+    compteur = nouveaux_parcours.cumsum()
+    total_avant_client = np.maximum.accumulate(np.where(nouveau_client, compteur - nouveaux_parcours, 0))
+    df_sorted['parcours_numero'] = pd.Series(compteur - total_avant_client, index=df_sorted.index).where(df_sorted['customer_id'].notna())
     print("-> Logique de parcours appliquée.")
 
     # 3.2. Expansion de chaque abonnement en lignes mensuelles
-    all_months_data = []
-    for row in df_sorted.itertuples(index=False):
-        if pd.isna(row.order_date) or pd.isna(row.ECHEANCE_date):
-            continue
-
-        date_range = pd.date_range(start=row.order_date, end=row.ECHEANCE_date, freq='MS')
-        if date_range.empty and pd.notna(row.order_date):
-            date_range = pd.to_datetime([row.order_date]).to_period('M').to_timestamp()
+    # Expansion vectorisée : un abonnement couvre les débuts de mois compris entre ses deux dates,
+    # ou à défaut son seul mois de souscription
+    df_sorted = df_sorted[df_sorted['order_date'].notna() & df_sorted['ECHEANCE_date'].notna()]
+    order_dates = df_sorted['order_date'].to_numpy()
+    order_months = order_dates.astype('datetime64[M]')
+    first_months = order_months + (order_dates != order_months.astype(order_dates.dtype))
+    end_months = df_sorted['ECHEANCE_date'].to_numpy().astype('datetime64[M]')
+    n_months = (end_months - first_months).astype('int64') + 1
+    first_months = np.where(n_months > 0, first_months, order_months)
+    n_months = np.maximum(n_months, 1)
+    row_idx = np.repeat(np.arange(len(df_sorted)), n_months)
+    month_offsets = np.arange(n_months.sum()) - np.repeat(np.cumsum(n_months) - n_months, n_months)
+    months = first_months[row_idx] + month_offsets
+
+    # Revenus convertis en une passe : un revenu absent reste NaN, un revenu illisible vaut 0
+    revenues_bruts = df_sorted['consolidated_revenues_ht_euro']
+    revenues = pd.to_numeric(revenues_bruts.astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    revenues = revenues.mask(revenues.isna() & revenues_bruts.notna(), 0).to_numpy()
+    frequences = df_sorted['frequence'].astype(str).str.lower()
+    montants = np.where(
+        frequences.str.contains('annuel', na=False), revenues / 12,
+        np.where(frequences.str.contains('mensuel', na=False), revenues, 0)
+    )
 
-        for month_date in date_range:
-            month_relatif = (month_date.year - row.order_date.year) * 12 + (month_date.month - row.order_date.month)
-            
-            montant_mensuel = 0
-            try:
-                revenue_str = str(getattr(row, 'consolidated_revenues_ht_euro', '0')).replace(',', '.')
-                revenue = float(revenue_str)
-                frequence_str = str(getattr(row, 'frequence', '')).lower()
-                if 'annuel' in frequence_str:
-                    montant_mensuel = revenue / 12
-                elif 'mensuel' in frequence_str:
-                    montant_mensuel = revenue
-            except (ValueError, TypeError):
-                montant_mensuel = 0
-
-            new_row = {
-                'offer_date': row.order_date, 'month': month_date, 'enrollment_month_number': row.order_date.month,
-                'month_relatif': month_relatif, 'is_first_subscription': row.parcours_numero == 1,
-                'Montant': montant_mensuel, 'customer_id': row.customer_id, 'subscription_id': row.subscription_id,
-                'frequence': row.frequence,
-                'order_date (Année)': row.order_date.year, 'order_date (Mois)': row.order_date.month,
-                'order_date (Jour du mois)': row.order_date.day, 'order_date': row.order_date,
-                'payment_origin': row.payment_origin, 'ECHEANCE_annee': row.ECHEANCE_date.year,
-                'ECHEANCE_mois': row.ECHEANCE_date.month, 'ECHEANCE_jour': row.ECHEANCE_date.day,
-                'date_fin_abo': row.ECHEANCE_date, 'psp': row.psp, 'order_paid_date_processed': row.order_paid_date_processed,
-                'discount': row.discount, 'custom_discount': row.custom_discount, 'tm_source': row.tm_source,
-                'tm_medium': row.tm_medium, 'tm_campaign': row.tm_campaign,
-                'consolidated_revenues_ht_euro': row.consolidated_revenues_ht_euro
-            }
-            all_months_data.append(new_row)
-    
-    final_df = pd.DataFrame(all_months_data)
+    expanded = df_sorted.iloc[row_idx].reset_index(drop=True)
+    order_date = expanded['order_date']
+    echeance_date = expanded['ECHEANCE_date']
+    final_df = pd.DataFrame({
+        'offer_date': order_date, 'month': months.astype('datetime64[ns]'), 'enrollment_month_number': order_date.dt.month,
+        'month_relatif': (months - order_months[row_idx]).astype('int64'),
+        'is_first_subscription': expanded['parcours_numero'] == 1,
+        'Montant': montants[row_idx], 'customer_id': expanded['customer_id'], 'subscription_id': expanded['subscription_id'],
+        'frequence': expanded['frequence'],
+        'order_date (Année)': order_date.dt.year, 'order_date (Mois)': order_date.dt.month,
+        'order_date (Jour du mois)': order_date.dt.day, 'order_date': order_date,
+        'payment_origin': expanded['payment_origin'], 'ECHEANCE_annee': echeance_date.dt.year,
+        'ECHEANCE_mois': echeance_date.dt.month, 'ECHEANCE_jour': echeance_date.dt.day,
+        'date_fin_abo': echeance_date, 'psp': expanded['psp'], 'order_paid_date_processed': expanded['order_paid_date_processed'],
+        'discount': expanded['discount'], 'custom_discount': expanded['custom_discount'], 'tm_source': expanded['tm_source'],
+        'tm_medium': expanded['tm_medium'], 'tm_campaign': expanded['tm_campaign'],
+        'consolidated_revenues_ht_euro': expanded['consolidated_revenues_ht_euro']
+    })
     print(f"-> Expansion mensuelle terminée. Résultat : {final_df.shape[0]} lignes.")
     return final_df
 
@@ -169,7 +205,9 @@ def main():
             
             df_monthly_report = df_monthly_report[final_columns]
             
-            df_monthly_report.to_csv(OUTPUT_FILE, index=False, encoding='utf-8-sig')
+            df_monthly_report.to_parquet(OUTPUT_FILE, index=False, compression='zstd')
+            if OUTPUT_CSV_FILE:
+                df_monthly_report.to_csv(OUTPUT_CSV_FILE, index=False, encoding='utf-8-sig')
             print(f"-> Pipeline terminé avec succès. Fichier de sortie : '{OUTPUT_FILE}'")
             print("\nAperçu des 5 premières lignes du résultat final :\n")
             print(df_monthly_report.head())
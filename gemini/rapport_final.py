@@ -5,13 +5,22 @@ Pipeline d'analyse complet des abonnements.
 Ce script transforme les données brutes en un rapport d'analyse multi-onglets
 contenant les analyses de rétention et les profils de cohortes de clients.
 """
+import os
+import sys
 import pandas as pd
 import numpy as np
+import xlsxwriter
+
+# Modules communs à la racine du dépôt : préparation des données (partagée avec recherche_upgrade.py)
+# et écriture Excel en flux (partagée avec Claude_retention_analysis.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_prep import TRANSACTIONS_FILE, COUPONS_FILE, prepare
+from export_excel import write_excel_sheet
 
 # --- CONFIGURATION ---
-TRANSACTIONS_FILE = 'transaction.csv'
-COUPONS_FILE = 'Table des coupons-1.xlsx - Coupons.csv'
 OUTPUT_FILE = 'rapport_analyse_abonnements.xlsx'
+# Colonnes de segmentation à faible cardinalité, stockées en catégories après l'agrégation
+COLONNES_CATEGORIELLES = ['nom_offre', 'frequence', 'payment_origin', 'psp', 'tm_source', 'tm_medium', 'tm_campaign', 'discount']
 
 # --- PARTIE 1 : PRÉPARATION DES DONNÉES (Fonctions regroupées) ---
 
@@ -19,12 +28,7 @@ def load_and_merge_data(transactions_path, coupons_path):
     """Charge, fusionne et enrichit les données initiales."""
     print("--- Étape 1: Chargement et fusion ---")
     try:
-        df_trans = pd.read_csv(transactions_path, encoding='latin1')
-        df_coupons = pd.read_csv(coupons_path, encoding='latin1')
-        df_merged = pd.merge(df_trans, df_coupons, left_on='discount', right_on='Coupon Id', how='left')
-        df_cleaned = df_merged.drop_duplicates().reset_index(drop=True)
-        df_cleaned['nom_offre'] = np.where(pd.notna(df_cleaned['tm_campaign']), df_cleaned['tm_campaign'], df_cleaned['discount'])
-        df_cleaned['nom_offre'] = df_cleaned['nom_offre'].fillna('Offre Standard')
+        df_cleaned = prepare(transactions_path, coupons_path)
         return df_cleaned
     except Exception as e:
         print(f"ERREUR CRITIQUE lors du chargement : {e}")
@@ -34,35 +38,36 @@ def group_and_repair_data(df):
     """Agrège les données et répare les dates manquantes."""
     if df is None: return None
     print("\n--- Étape 2: Agrégation et réparation des dates ---")
-    agg_logic = {col: 'first' for col in df.columns if col != 'subscription_id'}
-    agg_logic.update({'order_date': 'first', 'ECHEANCE_date': 'last'})
-    for col in ['order_date (Année)', 'order_date (Mois)', 'order_date (Jour du mois)', 'ECHEANCE_annee', 'ECHEANCE_mois', 'ECHEANCE_jour']:
-        agg_logic[col] = 'first'
-    df_grouped = df.groupby('subscription_id').agg(agg_logic).reset_index()
+    # 'first' (première valeur non nulle) calculé en un seul appel pour toutes les colonnes, 'last' pour l'échéance
+    groupes = df.groupby('subscription_id')
+    df_grouped = groupes.first()
+    df_grouped['ECHEANCE_date'] = groupes['ECHEANCE_date'].last()
+    df_grouped = df_grouped.reset_index()
     
     df_grouped['order_date'] = pd.to_datetime(df_grouped['order_date'], errors='coerce')
     df_grouped['ECHEANCE_date'] = pd.to_datetime(df_grouped['ECHEANCE_date'], errors='coerce')
 
-    # Reconstruction
-    to_reconstruct_order = pd.isna(df_grouped['order_date'])
-    if to_reconstruct_order.any():
-        date_cols = {'year': 'order_date (Année)', 'month': 'order_date (Mois)', 'day': 'order_date (Jour du mois)'}
-        rename_dict = {v: k for k, v in date_cols.items()}
-        df_rebuild = df_grouped.loc[to_reconstruct_order, list(date_cols.values())].rename(columns=rename_dict)
-        df_grouped.loc[to_reconstruct_order, 'order_date'] = pd.to_datetime(df_rebuild, errors='coerce')
-
-    to_reconstruct_echeance = pd.isna(df_grouped['ECHEANCE_date'])
-    if to_reconstruct_echeance.any():
-        date_cols = {'year': 'ECHEANCE_annee', 'month': 'ECHEANCE_mois', 'day': 'ECHEANCE_jour'}
-        rename_dict = {v: k for k, v in date_cols.items()}
-        df_rebuild = df_grouped.loc[to_reconstruct_echeance, list(date_cols.values())].rename(columns=rename_dict)
-        df_grouped.loc[to_reconstruct_echeance, 'ECHEANCE_date'] = pd.to_datetime(df_rebuild, errors='coerce')
+    # Reconstruction depuis les colonnes année / mois / jour, calculée en un appel sur tout le tableau
+    # et utilisée uniquement là où la date d'origine manque
+    date_parts = {
+        'order_date': ['order_date (Année)', 'order_date (Mois)', 'order_date (Jour du mois)'],
+        'ECHEANCE_date': ['ECHEANCE_annee', 'ECHEANCE_mois', 'ECHEANCE_jour']
+    }
+    for date_col, parts in date_parts.items():
+        reconstructed_dates = pd.to_datetime(df_grouped[parts].set_axis(['year', 'month', 'day'], axis=1), errors='coerce')
+        df_grouped[date_col] = df_grouped[date_col].fillna(reconstructed_dates)
+    
+    # Abonnement mensuel repéré une seule fois (recherche littérale, sans regex), réutilisé pour le délai de grâce
+    df_grouped['is_monthly'] = df_grouped['frequence'].str.contains('monthly', case=False, regex=False, na=False)
     
     # Imputation
-    condition_fix_echeance = (df_grouped['frequence'].str.lower().str.contains('monthly', na=False) & pd.isna(df_grouped['ECHEANCE_date']) & pd.notna(df_grouped['order_date']))
+    condition_fix_echeance = (df_grouped['is_monthly'] & pd.isna(df_grouped['ECHEANCE_date']) & pd.notna(df_grouped['order_date']))
     df_grouped.loc[condition_fix_echeance, 'ECHEANCE_date'] = df_grouped.loc[condition_fix_echeance, 'order_date'] + pd.Timedelta(days=30)
     
     df_grouped.dropna(subset=['order_date', 'ECHEANCE_date'], inplace=True)
+    # Colonnes de segmentation en catégories : value_counts, groupby et isin travaillent alors sur des codes entiers
+    for col in COLONNES_CATEGORIELLES:
+        df_grouped[col] = df_grouped[col].astype('category')
     return df_grouped
 
 def create_monthly_report(df_sub):
@@ -70,26 +75,38 @@ def create_monthly_report(df_sub):
     if df_sub is None: return None
     print("\n--- Étape 3: Création des parcours et expansion mensuelle ---")
     df_sorted = df_sub.sort_values(by=['customer_id', 'order_date']).copy()
+    # Identifiant client codé une seule fois en entiers, au niveau abonnement : les comptes distincts
+    # des tables de rétention hachent ces entiers plutôt que les identifiants d'origine. Un identifiant
+    # manquant (code -1 de factorize) reste manquant (Int32 nullable) et n'est donc pas compté comme un client.
+    codes_clients = pd.factorize(df_sorted['customer_id'])[0]
+    df_sorted['customer_code'] = pd.arrays.IntegerArray(codes_clients.astype(np.int32), codes_clients < 0)
     
     df_sorted['echeance_precedente'] = df_sorted.groupby('customer_id')['ECHEANCE_date'].shift(1)
     df_sorted['duree_trou_jours'] = (df_sorted['order_date'] - df_sorted['echeance_precedente']).dt.days
-    seuil_churn_jours = np.where(df_sorted['frequence'].str.lower().str.contains('monthly', na=False), 35, 90)
+    seuil_churn_jours = np.where(df_sorted['is_monthly'], 35, 90)
     df_sorted['nouveau_parcours'] = np.where((df_sorted['duree_trou_jours'].isna()) | (df_sorted['duree_trou_jours'] >= seuil_churn_jours), True, False)
     
-    df_sorted['id_parcours'] = df_sorted['customer_id'].astype(str) + '_' + df_sorted['nouveau_parcours'].cumsum().astype(str)
+    # Identifiant entier : le compteur cumulé des débuts de parcours est unique par parcours, puisque
+    # la première ligne de chaque client ouvre toujours un nouveau parcours
+    df_sorted['id_parcours'] = df_sorted['nouveau_parcours'].cumsum().astype('int64')
     df_sorted['journey_start_date'] = df_sorted.groupby('id_parcours')['order_date'].transform('min')
     
-    all_months_data = []
-    for row in df_sorted.itertuples(index=False):
-        start_month = row.order_date.to_period('M').to_timestamp()
-        end_month = row.ECHEANCE_date.to_period('M').to_timestamp()
-        date_range = pd.date_range(start=start_month, end=end_month, freq='MS')
-        for month_date in date_range:
-            month_relatif = (month_date.year - row.journey_start_date.year) * 12 + (month_date.month - row.journey_start_date.month)
-            new_row = {col: getattr(row, col) for col in row._fields}
-            new_row.update({'month': month_date, 'month_relatif': month_relatif})
-            all_months_data.append(new_row)
-    return pd.DataFrame(all_months_data)
+    # Expansion vectorisée : chaque abonnement est répété une fois par mois couvert,
+    # de son mois de souscription à son mois d'échéance
+    start_months = df_sorted['order_date'].to_numpy().astype('datetime64[M]')
+    end_months = df_sorted['ECHEANCE_date'].to_numpy().astype('datetime64[M]')
+    journey_start_months = df_sorted['journey_start_date'].to_numpy().astype('datetime64[M]')
+    n_months = np.maximum((end_months - start_months).astype('int64') + 1, 0)
+    row_idx = np.repeat(np.arange(len(df_sorted)), n_months)
+    month_offsets = np.arange(n_months.sum()) - np.repeat(np.cumsum(n_months) - n_months, n_months)
+    months = start_months[row_idx] + month_offsets
+
+    # Mois relatif par différence de mois entiers avec le début du parcours
+    final_df = df_sorted.iloc[row_idx].reset_index(drop=True).assign(
+        month=months.astype('datetime64[ns]'),
+        month_relatif=(months - journey_start_months[row_idx]).astype('int64')
+    )
+    return final_df
 
 
 # --- PARTIE 2 : FONCTIONS D'ANALYSE ---
@@ -102,27 +119,26 @@ def calculate_retention_tables(df):
     results = {}
     
     # Rétention Globale
-    initial_customers_global = df[df['month_relatif'] == 0]['customer_id'].nunique()
+    initial_customers_global = df[df['month_relatif'] == 0]['customer_code'].nunique()
     if initial_customers_global > 0:
-        retained_global = df.groupby('month_relatif')['customer_id'].nunique()
+        retained_global = df.groupby('month_relatif')['customer_code'].nunique()
         retention_global_rate = (retained_global / initial_customers_global)
         results['Retention_Globale'] = retention_global_rate.to_frame(name='Taux_Retention')
 
-    # Rétention Segmentée
+    # Rétention Segmentée : présence (client, mois relatif) dédoublonnée une seule fois, puis jointe aux
+    # clients de chaque segment pour compter tous les segments d'une caractéristique en un seul groupby
     df_initial_state = df[df['month_relatif'] == 0].drop_duplicates(subset=['id_parcours'])
+    # Lignes sans identifiant client écartées (présence et cohortes), comme nunique les ignore dans la rétention globale
+    presence_mensuelle = df[['customer_code', 'month_relatif']].dropna().drop_duplicates()
     characteristics = ['nom_offre', 'frequence', 'psp', 'payment_origin']
     for char in characteristics:
         top_segments = df_initial_state[char].value_counts().nlargest(7).index
-        retention_by_segment = {}
-        for segment in top_segments:
-            cohort_ids = df_initial_state[df_initial_state[char] == segment]['customer_id'].unique()
-            initial_count = len(cohort_ids)
-            if initial_count == 0: continue
-            df_cohort = df[df['customer_id'].isin(cohort_ids)]
-            retained_count = df_cohort.groupby('month_relatif')['customer_id'].nunique()
-            retention_rate = (retained_count / initial_count)
-            retention_by_segment[segment] = retention_rate
-        results[f'Retention_par_{char}'] = pd.DataFrame(retention_by_segment).fillna(0)
+        cohortes = df_initial_state.loc[df_initial_state[char].isin(top_segments), ['customer_code', char]].dropna(subset=['customer_code']).drop_duplicates()
+        initial_counts = cohortes[char].value_counts()
+        segments = [segment for segment in top_segments if initial_counts.get(segment, 0) > 0]
+        retained_counts = presence_mensuelle.merge(cohortes, on='customer_code').groupby([char, 'month_relatif'], observed=True).size().unstack(0)
+        retention_by_segment = retained_counts.reindex(columns=segments).div(initial_counts[segments]).fillna(0)
+        results[f'Retention_par_{char}'] = retention_by_segment.rename_axis(columns=None)
         
     return results
 
@@ -132,21 +148,24 @@ def characterize_cohorts(df):
     print("\n--- Étape 5: Analyse des profils de cohortes ---")
     
     results = {}
-    df['duree_parcours'] = df.groupby('id_parcours')['month_relatif'].transform('max')
+    # Durée de chaque parcours (dernier mois relatif atteint), une valeur par parcours, et cohorte correspondante
+    duree_par_parcours = df.groupby('id_parcours', sort=False)['month_relatif'].max()
+    cohorte_par_parcours = pd.cut(duree_par_parcours, bins=[-np.inf, 2, 12, np.inf], labels=['early_churn', 'standard', 'super_loyal'])
     
-    # Définition des cohortes
-    df_early_churn = df[df['duree_parcours'] <= 2].copy()
-    df_standard = df[(df['duree_parcours'] > 2) & (df['duree_parcours'] <= 12)].copy()
-    df_super_loyal = df[df['duree_parcours'] > 12].copy()
-
-    # Isoler l'état initial de chaque parcours pour chaque cohorte
-    churn_initial = df_early_churn[df_early_churn['month_relatif'] == 0].drop_duplicates(subset=['id_parcours'])
-    standard_initial = df_standard[df_standard['month_relatif'] == 0].drop_duplicates(subset=['id_parcours'])
-    loyal_initial = df_super_loyal[df_super_loyal['month_relatif'] == 0].drop_duplicates(subset=['id_parcours'])
+    # Isoler une seule fois l'état initial de chaque parcours (colonnes utiles uniquement),
+    # puis le répartir entre les cohortes
+    characteristics = ['nom_offre', 'frequence', 'payment_origin', 'psp', 'tm_source']
+    initial_state = df.loc[df['month_relatif'] == 0, ['id_parcours'] + characteristics]
+    initial_state = initial_state.drop_duplicates(subset=['id_parcours'])
+    cohorte = initial_state['id_parcours'].map(cohorte_par_parcours)
+    
+    # Définition des cohortes : churners précoces (<= 2 mois), standards (3-12 mois), super fidèles (> 12 mois)
+    churn_initial = initial_state[cohorte == 'early_churn']
+    standard_initial = initial_state[cohorte == 'standard']
+    loyal_initial = initial_state[cohorte == 'super_loyal']
     
     print(f"Taille des cohortes (parcours uniques) : Churners Précoces({len(churn_initial)}), Standards({len(standard_initial)}), Super Fidèles({len(loyal_initial)})")
 
-    characteristics = ['nom_offre', 'frequence', 'payment_origin', 'psp', 'tm_source']
     for char in characteristics:
         churn_dist = churn_initial[char].value_counts(normalize=True).mul(100)
         standard_dist = standard_initial[char].value_counts(normalize=True).mul(100)
@@ -157,15 +176,18 @@ def characterize_cohorts(df):
             'Standards (3-12m) (%)': standard_dist,
             'Super_Fideles (>12m) (%)': loyal_dist,
         }).fillna(0).sort_values(by='Super_Fideles (>12m) (%)', ascending=False)
+        # Catégories absentes des trois cohortes (comptées à 0) écartées
+        df_dist = df_dist[df_dist.any(axis=1)]
         results[f'Profil_par_{char}'] = df_dist.head(15).round(2)
         
     return results
 
 # --- PARTIE 3 : EXÉCUTION DU PIPELINE ---
 
-def main():
-    """Fonction principale qui orchestre l'ensemble du pipeline."""
-    df_initial = load_and_merge_data(TRANSACTIONS_FILE, COUPONS_FILE)
+def main(df_initial=None):
+    """Fonction principale qui orchestre l'ensemble du pipeline (df_initial : données déjà préparées par data_prep)."""
+    if df_initial is None:
+        df_initial = load_and_merge_data(TRANSACTIONS_FILE, COUPONS_FILE)
     df_aggregated = group_and_repair_data(df_initial)
     df_monthly_report = create_monthly_report(df_aggregated)
     
@@ -173,14 +195,15 @@ def main():
         retention_results = calculate_retention_tables(df_monthly_report)
         cohort_results = characterize_cohorts(df_monthly_report)
         
-        # Sauvegarde de tous les résultats dans un unique fichier Excel
+        # Sauvegarde de tous les résultats dans un unique fichier Excel, écrit en flux (constant_memory) :
+        # chaque ligne est envoyée sur le disque dès son écriture, l'index devenant la première colonne
         print(f"\n--- Étape 6: Sauvegarde du rapport Excel complet ---")
         try:
-            with pd.ExcelWriter(OUTPUT_FILE, engine='xlsxwriter') as writer:
+            with xlsxwriter.Workbook(OUTPUT_FILE, {'constant_memory': True}) as workbook:
                 for sheet_name, df_result in retention_results.items():
-                    df_result.to_excel(writer, sheet_name=sheet_name)
+                    write_excel_sheet(workbook, sheet_name, df_result.reset_index())
                 for sheet_name, df_result in cohort_results.items():
-                    df_result.to_excel(writer, sheet_name=sheet_name)
+                    write_excel_sheet(workbook, sheet_name, df_result.reset_index())
             print(f"-> Pipeline terminé. Fichier de sortie : '{OUTPUT_FILE}'")
         except Exception as e:
             print(f"ERREUR CRITIQUE lors de la sauvegarde du fichier Excel : {e}")
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Lance le rapport de rétention (gemini/rapport_final.py) et la recherche d'upgrades (recherche_upgrade.py)
+dans un même processus : les données ne sont chargées et fusionnées qu'une seule fois par data_prep.
+"""
+import os
+import sys
+
+# rapport_final.py se trouve dans le dossier gemini
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gemini'))
+
+import rapport_final
+import recherche_upgrade
+from data_prep import TRANSACTIONS_FILE, COUPONS_FILE, prepare
+
+def main():
+    """Prépare les données une fois puis les transmet aux deux analyses."""
+    print("--- Préparation commune des données ---")
+    try:
+        df_cleaned = prepare(TRANSACTIONS_FILE, COUPONS_FILE)
+    except Exception as e:
+        print(f"ERREUR CRITIQUE lors du chargement : {e}")
+        return
+
+    print("\n=== Rapport d'analyse des abonnements ===")
+    rapport_final.main(df_cleaned)
+    print("\n=== Recherche des upgrades de revenu ===")
+    recherche_upgrade.main(df_cleaned)
+
+if __name__ == "__main__":
+    main()
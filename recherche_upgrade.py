@@ -6,41 +6,36 @@ rapport détaillé comparant les caractéristiques de l'ancien et du nouvel abon
 import pandas as pd
 import numpy as np
 
+from data_prep import TRANSACTIONS_FILE, COUPONS_FILE, prepare
+
 # --- CONFIGURATION ---
-TRANSACTIONS_FILE = 'transaction.csv'
-COUPONS_FILE = 'Table des coupons-1.xlsx - Coupons.csv'
-OUTPUT_FILE = 'rapport_upgrades_revenu_detaille.csv'
+OUTPUT_FILE = 'rapport_upgrades_revenu_detaille.parquet'
+# Copie CSV optionnelle pour une lecture humaine (None : seul le Parquet, bien plus rapide à écrire, est produit)
+OUTPUT_CSV_FILE = None
 
-def load_and_prepare_data(transactions_path, coupons_path):
+def load_and_prepare_data(transactions_path, coupons_path, df_cleaned=None):
     """
     Charge, fusionne les données et les prépare pour l'analyse en
     créant une ligne unique et propre par abonnement.
+    df_cleaned : données déjà fusionnées par data_prep.prepare (chargées ici sinon).
     """
     print("--- Étape 1: Chargement et préparation des données ---")
     try:
-        df_trans = pd.read_csv(transactions_path, encoding='latin1')
-        df_coupons = pd.read_csv(coupons_path, encoding='latin1')
-        df_merged = pd.merge(df_trans, df_coupons, left_on='discount', right_on='Coupon Id', how='left')
-        df_cleaned = df_merged.drop_duplicates().reset_index(drop=True)
-        
-        df_cleaned['nom_offre'] = np.where(
-            pd.notna(df_cleaned['tm_campaign']), 
-            df_cleaned['tm_campaign'], 
-            df_cleaned['discount']
-        )
-        df_cleaned['nom_offre'] = df_cleaned['nom_offre'].fillna('Offre Standard')
+        if df_cleaned is None:
+            df_cleaned = prepare(transactions_path, coupons_path)
 
-        # Agrégation pour avoir une ligne par abonnement. 'first' préserve toutes les colonnes.
-        agg_logic = {col: 'first' for col in df_cleaned.columns if col != 'subscription_id'}
-        agg_logic['order_date'] = 'first' # Garder la première date de transaction comme référence
-        df_grouped = df_cleaned.groupby('subscription_id').agg(agg_logic).reset_index()
+        # Agrégation pour avoir une ligne par abonnement. 'first' (première valeur non nulle, dont la
+        # première date de transaction comme référence) préserve toutes les colonnes, en un seul appel.
+        df_grouped = df_cleaned.groupby('subscription_id').first().reset_index()
         
         # Nettoyage et conversion des types
         df_grouped['order_date'] = pd.to_datetime(df_grouped['order_date'], errors='coerce')
-        df_grouped['consolidated_revenues_ht_euro'] = pd.to_numeric(
-            df_grouped['consolidated_revenues_ht_euro'].astype(str).str.replace(',', '.'), 
-            errors='coerce'
-        )
+        # Revenus déjà numériques après la lecture ; s'ils sont restés du texte (formats mélangés),
+        # conversion en une passe sur les seules chaînes, sans repasser des nombres en texte
+        revenus = df_grouped['consolidated_revenues_ht_euro']
+        if not pd.api.types.is_numeric_dtype(revenus):
+            revenus = pd.to_numeric(revenus.str.replace(',', '.', regex=False), errors='coerce')
+        df_grouped['consolidated_revenues_ht_euro'] = revenus
         
         # Supprimer les lignes où les données essentielles pour l'analyse sont manquantes
         df_grouped.dropna(subset=['customer_id', 'order_date', 'consolidated_revenues_ht_euro'], inplace=True)
@@ -71,28 +66,33 @@ def find_revenue_upgrades(df):
         'tm_source', 'tm_medium', 'tm_campaign'
     ]
     
-    # Créer les colonnes '_precedent' pour chaque caractéristique
+    # S'assurer que chaque colonne existe avant de la comparer
     for col in cols_to_shift:
-        # S'assurer que la colonne existe avant de faire le 'shift'
-        if col in df_sorted.columns:
-            df_sorted[f'{col}_precedent'] = df_sorted.groupby('customer_id')[col].shift(1)
-        else:
+        if col not in df_sorted.columns:
             print(f"Avertissement : La colonne '{col}' est manquante et ne sera pas comparée.")
+    cols_presentes = [col for col in cols_to_shift if col in df_sorted.columns]
+    
+    # Isoler les lignes où le revenu actuel est supérieur au revenu précédent du même client
+    # (écart nul ou absent sur la première ligne de chaque client)
+    hausse = df_sorted.groupby('customer_id', sort=False)['consolidated_revenues_ht_euro'].diff() > 0
+    positions = np.flatnonzero(hausse.to_numpy())
+    df_upgrades = df_sorted.iloc[positions]
     
-    # Isoler les lignes où le revenu actuel est supérieur au revenu précédent
-    df_upgrades = df_sorted[
-        (df_sorted['consolidated_revenues_ht_euro'] > df_sorted['consolidated_revenues_ht_euro_precedent'])
-    ].copy()
+    # Colonnes '_precedent' lues sur la ligne juste avant chaque augmentation : les données étant triées
+    # par client, c'est l'abonnement précédent du même client
+    precedents = df_sorted.iloc[positions - 1][cols_presentes].add_suffix('_precedent').set_axis(df_upgrades.index)
+    df_upgrades = pd.concat([df_upgrades, precedents], axis=1)
     
     print(f"-> {len(df_upgrades)} abonnements correspondent à une augmentation de revenu.")
     
     return df_upgrades
 
-def main():
+def main(df_cleaned=None):
     """
     Fonction principale qui orchestre l'ensemble du pipeline.
+    df_cleaned : données déjà fusionnées par data_prep.prepare (chargées ici sinon).
     """
-    df_prepared = load_and_prepare_data(TRANSACTIONS_FILE, COUPONS_FILE)
+    df_prepared = load_and_prepare_data(TRANSACTIONS_FILE, COUPONS_FILE, df_cleaned)
     df_revenue_upgrades = find_revenue_upgrades(df_prepared)
     
     if df_revenue_upgrades is not None and not df_revenue_upgrades.empty:
@@ -132,7 +132,9 @@ def main():
         # Sauvegarde du rapport
         print(f"\n--- Étape 3: Sauvegarde du rapport très détaillé ---")
         try:
-            final_report_df.to_csv(OUTPUT_FILE, index=False, encoding='utf-8-sig')
+            final_report_df.to_parquet(OUTPUT_FILE, index=False, compression='zstd')
+            if OUTPUT_CSV_FILE:
+                final_report_df.to_csv(OUTPUT_CSV_FILE, index=False, encoding='utf-8-sig')
             print(f"-> Pipeline terminé. Le rapport a été sauvegardé dans : '{OUTPUT_FILE}'")
             print("\nExtrait du rapport des augmentations de revenu :\n")
             print(final_report_df.head())